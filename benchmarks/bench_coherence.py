@@ -0,0 +1,71 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import glob
+import re
+import time
+
+import spacy
+
+import process_pdf
+
+# usage: python benchmarks/bench_coherence.py [pdf ...]
+# compares the original per-page filter with the streaming accurate and fast modes
+# agreement is measured on the kept sentences, with the original filter as reference
+
+
+# the original filter: the full pipeline called once per page
+def original_filter(model):
+    def run(page_texts):
+        for page_text in page_texts:
+            doc = model(re.sub(r'\n+', ' ', page_text))
+            yield [str(sentence) for sentence in doc.sents if process_pdf.is_sentence_coherent(sentence)]
+    return run
+
+
+def streaming_filter(mode):
+    def run(page_texts):
+        return process_pdf.filter_coherent_pages(page_texts, mode)
+    return run
+
+
+def run(name, page_texts, filter_pages):
+    start = time.perf_counter()
+    pages = list(filter_pages(page_texts))
+    elapsed = time.perf_counter() - start
+    return name, elapsed, pages
+
+
+# function to compare kept sentences against the reference, as precision and recall
+def agreement(reference_pages, pages):
+    reference = {(index, sentence.strip()) for index, page in enumerate(reference_pages) for sentence in page}
+    kept = {(index, sentence.strip()) for index, page in enumerate(pages) for sentence in page}
+    overlap = len(reference & kept)
+    precision = overlap / len(kept) if kept else 1.0
+    recall = overlap / len(reference) if reference else 1.0
+    return precision, recall
+
+
+if __name__ == '__main__':
+    pdf_paths = sys.argv[1:] or sorted(glob.glob(os.path.join('data', '*', '*.pdf')))
+    if not pdf_paths:
+        sys.exit("No PDF files to benchmark, pass paths or download reports into data/ first.")
+
+    page_texts = [text for pdf_path in pdf_paths for text in process_pdf.extract_text_from_pdf(pdf_path)]
+
+    # load the models up front so loading time isn't part of the measurement
+    original_model = spacy.load("en_core_web_sm")
+    process_pdf.load_nlp('accurate')
+    process_pdf.load_nlp('fast')
+
+    results = [
+        run("original", page_texts, original_filter(original_model)),
+        run("pipe, accurate", page_texts, streaming_filter('accurate')),
+        run("pipe, fast", page_texts, streaming_filter('fast')),
+    ]
+    reference_pages = results[0][2]
+    for name, elapsed, pages in results:
+        precision, recall = agreement(reference_pages, pages)
+        print(f"{name:<16} {len(page_texts) / elapsed:8.1f} pages/s  precision {precision:.3f}  recall {recall:.3f}")
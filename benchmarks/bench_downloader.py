@@ -0,0 +1,50 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import importlib
+import tempfile
+import time
+
+from fake_reports_server import start_server
+
+# benchmark settings
+NUM_COMPANIES = 200
+PDF_SIZE = 512 * 1024
+SERVER_LATENCY = 0.02  # simulated server latency per request, in seconds
+WORKER_COUNTS = [1, 4, 8, 16]
+
+
+def run(base_url, num_workers):
+    # database_gen reads its settings at import time, so load a fresh copy for every configuration
+    os.environ['REPORTS_BASE_URL'] = base_url
+    os.environ['DOWNLOAD_WORKERS'] = str(num_workers)
+    os.environ['DOWNLOAD_MAX_PER_HOST'] = str(num_workers)
+    sys.modules.pop('database_gen', None)
+    database_gen = importlib.import_module('database_gen')
+
+    companies = [f"company{index}" for index in range(NUM_COMPANIES)]
+    start = time.perf_counter()
+    database_gen.process_companies(companies, num_workers)
+    elapsed = time.perf_counter() - start
+
+    reports = sum(len(years) for years in database_gen.data.values())
+    megabytes = reports * PDF_SIZE / (1024 * 1024)
+    print(f"{num_workers:3d} workers {elapsed:8.2f}s {NUM_COMPANIES / elapsed:8.1f} companies/s {megabytes / elapsed:8.1f} MB/s")
+
+
+if __name__ == '__main__':
+    server, base_url = start_server(pdf_size=PDF_SIZE, latency=SERVER_LATENCY)
+    working_directory = os.getcwd()
+    try:
+        for num_workers in WORKER_COUNTS:
+            # every run downloads into a fresh scratch directory
+            with tempfile.TemporaryDirectory() as scratch_dir:
+                os.chdir(scratch_dir)
+                try:
+                    run(base_url, num_workers)
+                finally:
+                    os.chdir(working_directory)
+    finally:
+        server.shutdown()
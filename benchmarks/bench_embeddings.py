@@ -0,0 +1,61 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+import tempfile
+import time
+
+from embedding_engine import BatchedEmbedder, EmbeddingCache, FakeEmbeddings
+
+# benchmark settings
+NUM_ENTRIES = 2000
+REPEAT_RATE = 0.2  # share of descriptions that repeat an earlier one
+REQUEST_LATENCY = 0.01  # simulated round trip per embedding request, in seconds
+BATCH_SIZE = 100
+
+
+# function to generate synthetic metric descriptions, some of them repeated
+def generate_descriptions(count, repeat_rate, seed=0):
+    rng = random.Random(seed)
+    words = ["renewable", "electricity", "emissions", "supplier", "employees", "water",
+             "waste", "diversity", "governance", "board", "carbon", "offices", "reduction"]
+    descriptions = []
+    for _ in range(count):
+        if descriptions and rng.random() < repeat_rate:
+            descriptions.append(rng.choice(descriptions))
+        else:
+            descriptions.append(' '.join(rng.choice(words) for _ in range(12)))
+    return descriptions
+
+
+def run_per_entry(descriptions):
+    model = FakeEmbeddings(latency=REQUEST_LATENCY)
+    for description in descriptions:
+        model.embed_query(description)
+    return model.calls
+
+
+def run_batched(descriptions, cache):
+    model = FakeEmbeddings(latency=REQUEST_LATENCY)
+    embedder = BatchedEmbedder(model, 'fake', cache=cache, batch_size=BATCH_SIZE)
+    embedder.embed(descriptions)
+    return model.calls
+
+
+def report(name, descriptions, run):
+    start = time.perf_counter()
+    calls = run()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed:8.2f}s {len(descriptions) / elapsed:10.1f} entries/s {calls:6d} requests")
+
+
+if __name__ == '__main__':
+    descriptions = generate_descriptions(NUM_ENTRIES, REPEAT_RATE)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = EmbeddingCache(os.path.join(cache_dir, 'cache.sqlite'))
+        report("per-entry embed_query", descriptions, lambda: run_per_entry(descriptions))
+        report("batched, cold cache", descriptions, lambda: run_batched(descriptions, cache))
+        report("batched, warm cache", descriptions, lambda: run_batched(descriptions, cache))
+        cache.close()
@@ -0,0 +1,151 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import glob
+import tempfile
+import time
+
+from fake_reports_server import start_server
+from synthetic_reports import report_factory
+
+# usage: python benchmarks/bench_end_to_end.py [results.json]
+# runs every stage offline: synthetic report PDFs served by the local stand-in server, the fake LLM and
+# embedding backends with simulated latency, mongomock and the local vector store
+# stages first run one after the other to measure each on its own, then all together through pipeline.py
+# the per-stage results can be saved as JSON to compare runs
+# needs the SpaCy model (en_core_web_sm) and mongomock installed
+
+# benchmark settings
+NUM_COMPANIES = 4
+YEARS = (2024, 2023)
+PAGES_PER_REPORT = 40
+SENTENCES_PER_PAGE = 12
+SERVER_LATENCY = 0.01  # seconds per HTTP request
+LLM_LATENCY = 0.2  # seconds per LLM request
+EMBED_LATENCY = 0.05  # seconds per embedding request
+
+# settings of the scripts, read when they are imported
+BENCH_ENVIRONMENT = {
+    'LLM_CACHE_MODE': 'off',
+    'LLM_REQUESTS_PER_SECOND': '1000',
+    'LLM_TOKENS_PER_MINUTE': '100000000',
+    'LLM_MAX_CONCURRENCY': '8',
+    'EMBEDDING_BACKEND': 'fake',
+    'FAKE_EMBEDDING_LATENCY': str(EMBED_LATENCY),
+    'FAKE_LLM_LATENCY': str(LLM_LATENCY),
+    'VECTOR_STORE': 'local',
+}
+
+
+# function to count the pages and entries the stages produced
+def count_outputs():
+    pages = 0
+    for path in glob.glob(os.path.join('text', '*', '*.json')):
+        with open(path, 'r') as text_file:
+            pages += len(json.load(text_file)['pages'])
+    entries = 0
+    for path in glob.glob(os.path.join('cleaned', '*', '*.ndjson')):
+        with open(path, 'r') as cleaned_file:
+            entries += sum(1 for line in cleaned_file if line.strip())
+    return pages, entries
+
+
+def measure(name, results, run, pages=None, entries=None):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    result = {'stage': name, 'seconds': round(elapsed, 3)}
+    line = f"{name:<10} {elapsed:8.2f}s"
+    if pages is not None:
+        result['pages_per_second'] = round(pages() / elapsed, 1)
+        line += f" {result['pages_per_second']:10.1f} pages/s"
+    if entries is not None:
+        result['entries_per_second'] = round(entries() / elapsed, 1)
+        line += f" {result['entries_per_second']:10.1f} entries/s"
+    print(line)
+    results.append(result)
+
+
+def run_benchmark(base_url):
+    os.environ.update(BENCH_ENVIRONMENT, REPORTS_BASE_URL=base_url)
+    import mongomock
+    import database_gen
+    import data_uploader
+    import llm_parse
+    import pipeline
+    from llm import fake_textgen
+    from instrumentation import metrics
+    from storage import atomic_write_json
+    from vector_store import LocalVectorStore
+
+    # the parser calls the fake model and the uploader writes to mongomock
+    llm_parse.generate_text_function = fake_textgen.generate_text
+    data_uploader.MongoClient = mongomock.MongoClient
+
+    companies = [f"company{index}" for index in range(NUM_COMPANIES)]
+    reports = []
+    results = []
+    total_pages = NUM_COMPANIES * len(YEARS) * PAGES_PER_REPORT
+
+    def download():
+        database_gen.process_companies(companies)
+        atomic_write_json(database_gen.data_file, database_gen.data, indent=4)
+        # oldest reports first, like llm_parse.py, so later reports are deduplicated against them
+        reports.extend((company_name, year) for company_name, years in database_gen.data.items() for year in sorted(years))
+
+    def run_stage(function):
+        return lambda: [function(company_name, report_year) for company_name, report_year in reports]
+
+    def upload():
+        data_uploader.upload_reports(reports)
+
+    print(f"{NUM_COMPANIES * len(YEARS)} reports of {PAGES_PER_REPORT} pages")
+    measure('download', results, download, pages=lambda: total_pages)
+    measure('process', results, run_stage(pipeline.run_process), pages=lambda: total_pages)
+    measure('parse', results, run_stage(pipeline.run_parse), pages=lambda: count_outputs()[0])
+    measure('clean', results, run_stage(pipeline.run_clean), entries=lambda: count_outputs()[1])
+    measure('normalize', results, run_stage(pipeline.run_normalize), entries=lambda: count_outputs()[1])
+    measure('upload', results, upload, entries=lambda: count_outputs()[1])
+    print(f"LLM requests: {fake_textgen.language_model.calls} ({metrics.counters.get(('llm_calls_saved', ()), 0)} saved by "
+          f"deduplication), entries: {count_outputs()[1]}")
+
+    # the same reports through the pipeline runner, with the stages of different reports overlapping
+    # the upload starts over from an empty collection, vector store and embedding cache like the first pass did,
+    # since replacing documents in mongomock and points in the HNSW graph costs far more than inserting them
+    data_uploader.FULL_UPLOAD = True
+    data_uploader.collection.delete_many({})
+    data_uploader.vector_store = LocalVectorStore('vector_store_pipelined')
+    data_uploader.embedder.cache = None
+    runner = pipeline.PipelineRunner(force=[stage.name for stage in pipeline.STAGES])
+    measure('pipelined', results, lambda: runner.run(reports), pages=lambda: total_pages,
+            entries=lambda: count_outputs()[1])
+    if pipeline.process_pool is not None:
+        pipeline.process_pool.shutdown()
+    return results
+
+
+if __name__ == '__main__':
+    server, base_url = start_server(latency=SERVER_LATENCY, years=YEARS,
+                                    pdf_factory=report_factory(PAGES_PER_REPORT, SENTENCES_PER_PAGE))
+    working_directory = os.getcwd()
+    output_path = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else None
+    try:
+        # every run starts from an empty scratch directory
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            os.chdir(scratch_dir)
+            try:
+                results = run_benchmark(base_url)
+            finally:
+                os.chdir(working_directory)
+    finally:
+        server.shutdown()
+
+    if output_path:
+        with open(output_path, 'w') as output_file:
+            json.dump({'settings': {
+                'companies': NUM_COMPANIES, 'years': YEARS, 'pages_per_report': PAGES_PER_REPORT,
+                'llm_latency': LLM_LATENCY, 'embed_latency': EMBED_LATENCY,
+            }, 'stages': results}, output_file, indent=2)
@@ -0,0 +1,53 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llm.backends import Router, create_backends
+
+# usage: python benchmarks/bench_llm_backends.py
+# sends page requests through the LLM router over two stub backends, 5% of whose requests are 20x slower,
+# and reports the p50/p99 page latency without hedging and with hedged requests,
+# then takes one backend down to show the circuit breaker routing around it
+
+NUM_REQUESTS = 400
+CONCURRENCY = 4  # requests sent at once, like LLM_MAX_CONCURRENCY
+PROMPT = '```start["In 2024 we cut Scope 1 emissions by 12 percent."]end```## Output'
+
+STUB_BACKENDS = [
+    {"provider": "stub", "name": "stub-a", "latency": 0.02, "slow_fraction": 0.05, "slow_latency": 0.4, "seed": 1,
+     "max_concurrency": 8},
+    {"provider": "stub", "name": "stub-b", "latency": 0.03, "slow_fraction": 0.05, "slow_latency": 0.4, "seed": 2,
+     "max_concurrency": 8},
+]
+
+
+def run(name, configs, hedge_after=''):
+    router = Router(create_backends(configs), hedge_after=hedge_after, seed=0)
+
+    def request(_):
+        start = time.perf_counter()
+        try:
+            router.generate(PROMPT)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        results = list(pool.map(request, range(NUM_REQUESTS)))
+    latencies = sorted(latency for latency in results if latency is not None)
+    stats = router.stats()
+    print(f"{name:<24} p50 {latencies[len(latencies) // 2]:6.3f}s p99 {latencies[int(0.99 * len(latencies))]:6.3f}s "
+          f"failed {results.count(None):3} hedges {stats['hedges']:3} ({stats['hedge_wins']} won)")
+    for backend_name, backend_stats in stats['backends'].items():
+        print(f"  {backend_name:<10} {backend_stats}")
+
+
+if __name__ == '__main__':
+    run("no hedging", STUB_BACKENDS)
+    run("hedge after 0.1s", STUB_BACKENDS, hedge_after='0.1')
+    run("hedge after p90", STUB_BACKENDS, hedge_after='p90')
+    run("stub-a down", [dict(STUB_BACKENDS[0], failure_rate=1.0), STUB_BACKENDS[1]])
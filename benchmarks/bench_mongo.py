@@ -0,0 +1,105 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+
+from mongo_writer import ensure_indexes, upsert_entries
+
+# usage: BENCH_MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_mongo.py
+# measures the throughput of every upload path against the mongod at BENCH_MONGO_URI, along with its round trips
+# without BENCH_MONGO_URI it runs against mongomock, which only checks the round trip counts and that re-running
+# the upload doesn't duplicate documents, mongomock has no network and its timings say nothing about a server
+# the benchmark drops and recreates the bench_sustainability_db database
+
+# benchmark settings
+NUM_ENTRIES = 2000
+BATCH_SIZES = [100, 1000]
+
+
+class RoundTripCollection:
+    """Wraps a collection, counting the calls that would each be a network round trip."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if name not in ('insert_many', 'bulk_write', 'create_index', 'delete_many', 'count_documents', 'drop'):
+            return attribute
+
+        def call(*args, **kwargs):
+            self.round_trips += 1
+            return attribute(*args, **kwargs)
+        return call
+
+
+def get_collection():
+    mongo_uri = os.getenv('BENCH_MONGO_URI')
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+        backend = mongo_uri
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+        backend = 'mongomock'
+    client.drop_database('bench_sustainability_db')
+    return RoundTripCollection(client['bench_sustainability_db']['company_metrics']), backend
+
+
+# function to generate synthetic cleaned entries
+def generate_entries(count):
+    return [
+        {
+            "id": f"2023.{index}",
+            "value": f"{index} metric tons",
+            "metric": True,
+            "topic": "ESG"[index % 3],
+            "description": f"Synthetic metric number {index}",
+            "tags": ["emissions", f"tag{index % 20}"],
+        }
+        for index in range(count)
+    ]
+
+
+# the previous upload path: one insert_many call per entry
+def insert_one_by_one(collection, entries):
+    for entry in entries:
+        collection.insert_many([dict(entry, company="bench", year="2023")])
+
+
+def report(name, collection, entries, run, timed):
+    collection.round_trips = 0
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    line = f"{name:<32} {collection.round_trips:6d} round trips"
+    if timed:
+        line += f" {elapsed:8.2f}s {len(entries) / elapsed:10.1f} entries/s"
+    print(line)
+
+
+if __name__ == '__main__':
+    entries = generate_entries(NUM_ENTRIES)
+    collection, backend = get_collection()
+    timed = backend != 'mongomock'
+    print(f"backend: {backend}, {NUM_ENTRIES} entries")
+    if not timed:
+        print("mongomock only checks round trips and idempotency, set BENCH_MONGO_URI to measure throughput")
+
+    report("insert_many, batch of 1", collection, entries, lambda: insert_one_by_one(collection, entries), timed)
+    collection.drop()
+
+    ensure_indexes(collection)
+    for batch_size in BATCH_SIZES:
+        collection.delete_many({})
+        report(f"bulk upsert, batch of {batch_size}", collection, entries,
+               lambda: upsert_entries(collection, "bench", "2023", entries, batch_size), timed)
+
+    # re-running the upload replaces documents instead of duplicating them
+    report("bulk upsert, re-run", collection, entries,
+           lambda: upsert_entries(collection, "bench", "2023", entries, BATCH_SIZES[-1]), timed)
+    print(f"documents after re-run: {collection.count_documents({})}")
@@ -0,0 +1,56 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import glob
+import tempfile
+import time
+
+import process_pdf
+from pdf_backends import BACKENDS
+from synthetic_reports import make_report_pdf
+
+# usage: python benchmarks/bench_pdf_backends.py [pdf ...]
+# compares the PDF extraction backends on the given reports, or on a synthetic report when none are given:
+# pages/s of text extraction alone, and the units (coherent sentences and table rows) the coherence filter keeps
+# backends that aren't installed are skipped, the yield needs the SpaCy model (en_core_web_sm)
+
+SYNTHETIC_PAGES = 200
+
+
+# function to extract the text of every page with a backend
+def extract(pdf_paths, backend):
+    return [page_text for pdf_path in pdf_paths for page_text in process_pdf.extract_text_from_pdf(pdf_path, backend=backend)]
+
+
+def run(pdf_paths, backend):
+    start = time.perf_counter()
+    page_texts = extract(pdf_paths, backend)
+    elapsed = time.perf_counter() - start
+
+    pages = list(process_pdf.filter_coherent_pages(page_texts))
+    units = [unit for page in pages for unit in page]
+    table_rows = sum(1 for unit in units if ' | ' in unit)
+    with_numbers = sum(1 for unit in units if any(character.isdigit() for character in unit))
+    print(f"{backend:<10} {elapsed:8.2f}s {len(page_texts) / elapsed:10.1f} pages/s "
+          f"{len(units) - table_rows:10} sentences {table_rows:8} table rows {with_numbers:8} with numbers")
+
+
+if __name__ == '__main__':
+    pdf_paths = sys.argv[1:] or sorted(glob.glob(os.path.join('data', '*', '*.pdf')))
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        if not pdf_paths:
+            pdf_path = os.path.join(scratch_dir, 'synthetic.pdf')
+            with open(pdf_path, 'wb') as pdf_file:
+                pdf_file.write(make_report_pdf('example', 2024, SYNTHETIC_PAGES))
+            pdf_paths = [pdf_path]
+            print(f"synthetic report of {SYNTHETIC_PAGES} pages")
+
+        # load the model up front so it isn't timed
+        process_pdf.load_nlp()
+        for backend in BACKENDS:
+            try:
+                run(pdf_paths, backend)
+            except ImportError as error:
+                print(f"{backend:<10} skipped: {error}")
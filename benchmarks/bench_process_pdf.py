@@ -0,0 +1,44 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import glob
+import tempfile
+import time
+
+import process_pdf
+
+# usage: python benchmarks/bench_process_pdf.py [pdf ...]
+# defaults to every report already downloaded under data/
+
+
+# function to build the report tuples expected by process_pdf, writing into a scratch directory
+def build_reports(pdf_paths, output_dir):
+    return [
+        ('bench', str(index), pdf_path, os.path.join(output_dir, f"{index}.json"))
+        for index, pdf_path in enumerate(pdf_paths)
+    ]
+
+
+def run(name, pdf_paths, process):
+    with tempfile.TemporaryDirectory() as output_dir:
+        reports = build_reports(pdf_paths, output_dir)
+        start = time.perf_counter()
+        process(reports)
+        elapsed = time.perf_counter() - start
+    pages = sum(process_pdf.count_pdf_pages(pdf_path) for pdf_path in pdf_paths)
+    print(f"{name:<24} {elapsed:8.2f}s {pages / elapsed:8.1f} pages/s")
+    return elapsed
+
+
+if __name__ == '__main__':
+    pdf_paths = sys.argv[1:] or sorted(glob.glob(os.path.join('data', '*', '*.pdf')))
+    if not pdf_paths:
+        sys.exit("No PDF files to benchmark, pass paths or download reports into data/ first.")
+
+    # the serial path loads the model in this process, load it up front so it isn't timed
+    process_pdf.load_nlp()
+    serial = run("serial", pdf_paths, process_pdf.process_reports_serial)
+    parallel = run(f"parallel ({process_pdf.NUM_WORKERS} workers)", pdf_paths, process_pdf.process_reports_parallel)
+    print(f"speedup: {serial / parallel:.2f}x")
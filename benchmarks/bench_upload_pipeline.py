@@ -0,0 +1,99 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+from types import SimpleNamespace
+
+from embedding_engine import BatchedEmbedder, FakeEmbeddings
+from mongo_writer import upsert_entries
+from upload_pipeline import UploadPipeline, vector_metadata
+
+# usage: python benchmarks/bench_upload_pipeline.py
+# compares the sequential upload (embed, then upsert, then write, one batch at a time)
+# with the pipelined upload, against backends that only simulate their latency
+
+# benchmark settings
+NUM_REPORTS = 10
+ENTRIES_PER_REPORT = 500
+UPLOAD_BATCH_SIZE = 100
+EMBED_LATENCY = 0.15  # seconds per embedding request
+VECTOR_LATENCY = 0.10  # seconds per upsert
+MONGO_LATENCY = 0.05  # seconds per bulk write
+
+
+class FakeVectorIndex:
+    def __init__(self, latency):
+        self.latency = latency
+        self.vectors = 0
+
+    def upsert(self, vectors):
+        time.sleep(self.latency)
+        self.vectors += len(vectors)
+
+
+class FakeCollection:
+    def __init__(self, latency):
+        self.latency = latency
+        self.documents = {}
+
+    def bulk_write(self, operations, ordered=True):
+        time.sleep(self.latency)
+        upserted = 0
+        for operation in operations:
+            document = operation._doc
+            upserted += document['_id'] not in self.documents
+            self.documents[document['_id']] = document
+        return SimpleNamespace(upserted_count=upserted, modified_count=len(operations) - upserted)
+
+
+def generate_reports():
+    return [
+        (f"company{report}", "2023", [
+            {"id": f"2023.{index}", "value": str(index), "topic": "E", "description": f"metric {report} {index}"}
+            for index in range(ENTRIES_PER_REPORT)
+        ])
+        for report in range(NUM_REPORTS)
+    ]
+
+
+def make_backends():
+    embedder = BatchedEmbedder(FakeEmbeddings(latency=EMBED_LATENCY), 'fake', batch_size=UPLOAD_BATCH_SIZE)
+    return embedder, FakeVectorIndex(VECTOR_LATENCY), FakeCollection(MONGO_LATENCY)
+
+
+def run_sequential(reports):
+    embedder, vector_index, collection = make_backends()
+    for company_name, report_year, entries in reports:
+        for start in range(0, len(entries), UPLOAD_BATCH_SIZE):
+            batch = entries[start:start + UPLOAD_BATCH_SIZE]
+            vectors = embedder.embed([entry["description"] for entry in batch])
+            vector_index.upsert(vectors=[
+                {"id": entry["id"], "values": vector, "metadata": vector_metadata(entry)}
+                for entry, vector in zip(batch, vectors)
+            ])
+            upsert_entries(collection, company_name, report_year, batch, UPLOAD_BATCH_SIZE)
+
+
+def run_pipelined(reports):
+    embedder, vector_index, collection = make_backends()
+    pipeline = UploadPipeline(embedder, vector_index, collection, upload_batch_size=UPLOAD_BATCH_SIZE,
+                              mongo_batch_size=UPLOAD_BATCH_SIZE * 10)
+    return pipeline.run(reports)
+
+
+def report(name, run):
+    reports = generate_reports()
+    start = time.perf_counter()
+    result = run(reports)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12} {elapsed:8.2f}s {NUM_REPORTS * ENTRIES_PER_REPORT / elapsed:10.1f} entries/s")
+    return result
+
+
+if __name__ == '__main__':
+    report("sequential", run_sequential)
+    stats = report("pipelined", run_pipelined)
+    for stage, stage_stats in stats.items():
+        print(f"  {stage:<10} {stage_stats}")
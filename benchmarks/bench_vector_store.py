@@ -0,0 +1,106 @@
+import sys
+import os
+# add the repository root to the Python module search path so the scripts' modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from vector_store import LocalVectorStore
+
+# usage: python benchmarks/bench_vector_store.py [embeddings_cache.sqlite]
+# measures recall@k and query latency of the local vector store against exact brute-force NumPy search
+# uses the real embeddings recorded in the embedding cache when given, synthetic clustered vectors otherwise
+
+# benchmark settings
+NUM_SYNTHETIC = 20000
+SYNTHETIC_DIMENSION = 1536
+NUM_QUERIES = 200
+TOP_K = 10
+COMPANIES = [f"company{index}" for index in range(20)]
+YEARS = ["2022", "2023", "2024"]
+
+
+def load_embeddings(cache_path):
+    connection = sqlite3.connect(cache_path)
+    blobs = [blob for (blob,) in connection.execute("SELECT vector FROM embeddings")]
+    connection.close()
+    return np.stack([np.frombuffer(blob, dtype=np.float32) for blob in blobs])
+
+
+def synthetic_embeddings(count, dimension, rng):
+    # clustered vectors, closer to real description embeddings than uniform noise
+    centers = rng.normal(size=(count // 50, dimension)).astype(np.float32)
+    return centers[rng.integers(0, len(centers), count)] + 0.3 * rng.normal(size=(count, dimension)).astype(np.float32)
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def brute_force(vectors, metadata, query, top_k, filter):
+    # exact cosine search with NumPy, the reference the local store is measured against
+    if filter:
+        rows = np.array([row for row, meta in enumerate(metadata)
+                         if all(meta[field] == value for field, value in filter.items())])
+    else:
+        rows = np.arange(len(vectors))
+    scores = vectors[rows] @ query
+    return set(rows[np.argsort(-scores)[:top_k]].tolist())
+
+
+def run(name, store, vectors, metadata, queries, filters):
+    latencies = []
+    recalls = []
+    for query, filter in zip(queries, filters):
+        start = time.perf_counter()
+        if store is None:
+            # the reference run times the exact search itself
+            brute_force(vectors, metadata, query, TOP_K, filter)
+            latencies.append(time.perf_counter() - start)
+            continue
+        result = store.query(query, top_k=TOP_K, filter=filter)
+        latencies.append(time.perf_counter() - start)
+        expected = brute_force(vectors, metadata, query, TOP_K, filter)
+        found = {int(match['id']) for match in result['matches']}
+        recalls.append(len(expected & found) / max(1, len(expected)))
+    latencies = np.array(latencies) * 1000
+    recall = f"recall@{TOP_K} {np.mean(recalls):.3f}" if recalls else f"recall@{TOP_K} 1.000 (exact)"
+    print(f"{name:<28} {recall}  p50 {np.percentile(latencies, 50):7.2f}ms  p99 {np.percentile(latencies, 99):7.2f}ms")
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    if len(sys.argv) > 1:
+        vectors = load_embeddings(sys.argv[1])
+        print(f"{len(vectors)} embeddings from {sys.argv[1]}")
+    else:
+        vectors = synthetic_embeddings(NUM_SYNTHETIC, SYNTHETIC_DIMENSION, rng)
+        print(f"{len(vectors)} synthetic embeddings")
+    vectors = normalize(vectors.astype(np.float32))
+    metadata = [{"company": COMPANIES[row % len(COMPANIES)], "year": YEARS[row % len(YEARS)]} for row in range(len(vectors))]
+
+    # queries are perturbed copies of stored vectors, half of them filtered on company and year
+    query_rows = rng.integers(0, len(vectors), NUM_QUERIES)
+    queries = normalize(vectors[query_rows] + 0.05 * rng.normal(size=(NUM_QUERIES, vectors.shape[1])).astype(np.float32))
+    filters = [None if index % 2 else dict(metadata[row]) for index, row in enumerate(query_rows)]
+
+    run("numpy brute force", None, vectors, metadata, queries, filters)
+    with tempfile.TemporaryDirectory() as store_dir:
+        for name, options in [
+            ("local flat float32", {'use_hnsw': False}),
+            ("local flat int8", {'use_hnsw': False, 'quantize': True}),
+            ("local hnsw float32", {'use_hnsw': True}),
+        ]:
+            store = LocalVectorStore(os.path.join(store_dir, name.replace(' ', '_')), dimension=vectors.shape[1], **options)
+            start = time.perf_counter()
+            for begin in range(0, len(vectors), 1000):
+                store.upsert([
+                    {'id': str(row), 'values': vectors[row], 'metadata': metadata[row]}
+                    for row in range(begin, min(begin + 1000, len(vectors)))
+                ])
+            print(f"{name:<28} built in {time.perf_counter() - start:.2f}s")
+            run(name, store, vectors, metadata, queries, filters)
@@ -0,0 +1,111 @@
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# local stand-in for responsibilityreports.com
+# serves the search page, company pages and report PDFs with the markup database_gen.py scrapes
+# usage: python benchmarks/fake_reports_server.py [port]
+
+
+# function to build the title a company is listed under
+def company_title(company_name):
+    return f"{company_name.title()} Inc"
+
+
+# function to build placeholder PDF bytes of a given size
+def placeholder_pdf(company_name, year, size):
+    header = f"%PDF-1.4\n% {company_title(company_name)} {year}\n".encode('utf-8')
+    return header + b'0' * max(0, size - len(header))
+
+
+class FakeReportsHandler(BaseHTTPRequestHandler):
+    # settings shared by all requests, set through start_server
+    pdf_size = 256 * 1024
+    latency = 0.0
+    years = (2024, 2023)
+    pdf_factory = staticmethod(placeholder_pdf)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+
+        if url.path == '/Companies':
+            company_name = parse_qs(url.query).get('search', [''])[0]
+            body = (
+                f'<html><body><span class="companyName">'
+                f'<a href="/Company/{company_name}">{company_title(company_name)}</a></span></body></html>'
+            )
+            self.send_body(body.encode('utf-8'), 'text/html')
+        elif parts[0] == 'Company' and len(parts) == 2:
+            self.send_body(self.company_page(parts[1]).encode('utf-8'), 'text/html')
+        elif parts[0] == 'Click' and len(parts) == 3:
+            year = parts[2].split('.')[0]
+            body = self.pdf_factory(parts[1], year, self.pdf_size)
+            # reports carry an ETag, and conditional GETs for unchanged reports get a 304
+            etag = f'"{hashlib.sha256(body).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_body(body, 'application/pdf', {'ETag': etag})
+        else:
+            self.send_error(404)
+
+    def company_page(self, company_name):
+        recent_year, *archived_years = self.years
+        archived = ''.join(
+            f'<li><span class="heading">{year} Sustainability Report</span>'
+            f'<span class="btn_archived download"><a href="/Click/{company_name}/{year}.pdf">Download</a></span></li>'
+            for year in archived_years
+        )
+        return (
+            f'<html><body><div class="most_recent_content_block">'
+            f'<span class="bold_txt">{recent_year} Sustainability Report</span>'
+            f'<div class="view_btn"><a class="btn_form_10k" href="/Click/{company_name}/{recent_year}.pdf">View</a></div>'
+            f'</div><ul>{archived}</ul></body></html>'
+        )
+
+
+# function to start the server on a background thread
+# returns the server and its base URL, call server.shutdown() to stop it
+def start_server(port=0, pdf_size=None, latency=None, years=None, pdf_factory=None):
+    handler = type('ConfiguredFakeReportsHandler', (FakeReportsHandler,), {})
+    if pdf_size is not None:
+        handler.pdf_size = pdf_size
+    if latency is not None:
+        handler.latency = latency
+    if years is not None:
+        handler.years = tuple(years)
+    if pdf_factory is not None:
+        handler.pdf_factory = staticmethod(pdf_factory)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    import sys
+    server, base_url = start_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print(f"Serving fake reports on {base_url}, set REPORTS_BASE_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
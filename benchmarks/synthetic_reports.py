@@ -0,0 +1,158 @@
+import random
+import zlib
+
+# generator of synthetic CSR report PDFs, written with the standard library only
+# every page mixes metric sentences the parser should extract with headings and page numbers it should drop,
+# and table rows of separately placed cells, and the same company, year and size always produce the same bytes
+# like real reports, every page repeats a footer and the last page is a disclaimer that is the same every year
+# usage: python benchmarks/synthetic_reports.py output.pdf [pages]
+
+METRIC_SENTENCES = [
+    "In fiscal year {year}, {company} reduced Scope 1 and Scope 2 emissions by {percent} percent compared to the baseline.",
+    "{company} sourced {percent} percent of the electricity used by its offices and data centers from renewable sources.",
+    "Our facilities avoided {number} metric tons of CO2e through efficiency projects completed during the year.",
+    "{company} invested ${amount} million in community programs and supplier diversity initiatives.",
+    "Women held {percent} percent of leadership positions across the company at the end of {year}.",
+    "We diverted {percent} percent of operational waste from landfill through recycling and composting programs.",
+    "The board of directors approved a climate transition plan that targets net zero emissions by {target}.",
+    "Employees completed {number} hours of training on ethics, safety and data privacy.",
+    "{company} reduced water withdrawal at its manufacturing sites by {number} cubic meters.",
+    "Independent directors make up {percent} percent of the board, including the chair of the audit committee.",
+]
+
+FILLER_LINES = [
+    "Sustainability Report {year}",
+    "Environmental, Social and Governance",
+    "Key performance indicators",
+    "Contents",
+    "Page {page}",
+]
+
+# sentence repeated at the bottom of every page
+FOOTER_SENTENCE = "{company} prepared this report in accordance with the GRI Standards and the SASB framework."
+
+# last page of every report, unchanged from year to year
+DISCLAIMER_SENTENCES = [
+    "This report contains forward-looking statements about our sustainability goals, plans and expectations.",
+    "Such statements are based on current assumptions and involve risks and uncertainties that could cause results to differ.",
+    "We undertake no obligation to update any forward-looking statement to reflect events after the date of publication.",
+    "Information on websites referenced in this report is not incorporated by reference into this report.",
+    "Certain data in this report are estimates and may be restated as measurement methods improve over time.",
+]
+
+# rows of the key performance indicator tables, laid out as separate cells like in real reports
+TABLE_ROWS = [
+    "Scope 1 emissions (tCO2e)",
+    "Scope 2 emissions (tCO2e)",
+    "Renewable electricity (%)",
+    "Water withdrawal (m3)",
+    "Women in leadership (%)",
+    "Independent directors (%)",
+]
+
+
+# function to escape text for a PDF string literal
+def escape_pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+# function to wrap text into lines of at most width characters
+def wrap_text(text, width=95):
+    lines = []
+    line = ''
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+# function to generate the lines of text of every page
+def report_lines(company_name, year, pages, sentences_per_page):
+    rng = random.Random(f"{company_name}/{year}")
+    for page in range(pages):
+        values = {
+            'company': company_name.title(), 'year': year, 'page': page + 1, 'target': rng.choice([2030, 2040, 2050]),
+            'percent': rng.randint(5, 95), 'number': f"{rng.randint(1000, 900000):,}", 'amount': rng.randint(2, 400),
+        }
+        if page == pages - 1:
+            lines = [line for sentence in DISCLAIMER_SENTENCES for line in wrap_text(sentence)]
+            yield lines + [FILLER_LINES[-1].format(**values)]
+            continue
+        lines = [rng.choice(FILLER_LINES[:2]).format(**values), '']
+        for _ in range(sentences_per_page):
+            roll = rng.random()
+            if roll < 0.1:
+                lines.append(rng.choice(FILLER_LINES[2:4]).format(**values))
+            elif roll < 0.25:
+                # a table row is a list of cells
+                lines.append([rng.choice(TABLE_ROWS)] + [f"{rng.randint(10, 90000):,}" for _ in range(3)])
+            else:
+                lines.extend(wrap_text(rng.choice(METRIC_SENTENCES).format(**values)))
+            values.update(percent=rng.randint(5, 95), number=f"{rng.randint(1000, 900000):,}", amount=rng.randint(2, 400))
+        lines.extend(wrap_text(FOOTER_SENTENCE.format(**values)))
+        lines.append(FILLER_LINES[-1].format(**values))
+        yield lines
+
+
+# function to build the text operators of a line, table cells are spread out with large gaps between them
+def line_operators(line):
+    if isinstance(line, list):
+        label, *values = line
+        cells = f"({escape_pdf_text(label)}) -{(32 - len(label)) * 500 + 4000} " + ' -4000 '.join(
+            f"({escape_pdf_text(value)})" for value in values)
+        return f"[{cells}] TJ T* "
+    return f"({escape_pdf_text(line)}) Tj T* "
+
+
+# function to build a synthetic report PDF with compressed content streams
+def make_report_pdf(company_name, year, pages=20, sentences_per_page=12):
+    objects = []  # object bodies, object n is objects[n - 1]
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for lines in report_lines(company_name, str(year), pages, sentences_per_page):
+        text = ''.join(line_operators(line) for line in lines)
+        stream = zlib.compress(f"BT /F1 10 Tf 14 TL 50 760 Td {text}ET".encode('latin-1', 'replace'))
+        contents = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 %d 0 R >> >> "
+            b"/Contents %d 0 R >>" % (page_tree, font, contents)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % page_tree
+    kids = b' '.join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[page_tree - 1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b''.join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref_offset)
+    return bytes(output)
+
+
+# function to build a pdf_factory for fake_reports_server.start_server serving reports of a fixed size
+def report_factory(pages=20, sentences_per_page=12):
+    def factory(company_name, year, size=None):
+        return make_report_pdf(company_name, year, pages, sentences_per_page)
+    return factory
+
+
+if __name__ == '__main__':
+    import sys
+    with open(sys.argv[1], 'wb') as pdf_file:
+        pdf_file.write(make_report_pdf('example', 2024, int(sys.argv[2]) if len(sys.argv) > 2 else 20))
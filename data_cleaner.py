@@ -1,86 +1,208 @@
 import os
+import re
 import json
 import tqdm
 
-# create the 'cleaned' directory 
-if not os.path.exists('cleaned'):
-    os.mkdir('cleaned')
+from storage import atomic_open
+from instrumentation import metrics, instrumented_run
 
-# load the dataset from the database file
-with open("database.json", 'r') as database_file:
-    dataset = json.load(database_file)
+# matches every "```start ... end```" block of a response in a single pass
+# a block cut off by the end of the response (a truncated completion) runs to the end of the text
+FENCED_BLOCK_PATTERN = re.compile(r"```start(.*?)(?:end```|\Z)", re.DOTALL)
 
-def extract_substring(text, start_marker, end_marker):
-    # locate the start marker
-    start_pos = text.find(start_marker)
-    if start_pos == -1:
-        return None  # start marker not found
+# size of the pieces parsed files are read in
+READ_CHUNK_SIZE = 1024 * 1024
 
-    # adjust position to the actual start of the substring
-    start_pos += len(start_marker)
+json_decoder = json.JSONDecoder()
 
-    # locate the end marker
-    end_pos = text.find(end_marker, start_pos)
-    if end_pos == -1:
-        return None  
 
-    # extract and return the substring
-    return text[start_pos:end_pos]
+# function to stream the records of a parsed file's 'parsed_pages' array one at a time,
+# reading the file in pieces so the whole report is never loaded at once
+def iter_parsed_records(source_path, chunk_size=READ_CHUNK_SIZE):
+    with open(source_path, 'r') as parsed_file:
+        buffer = ''
+        position = None
+        end_of_file = False
+        while True:
+            if not end_of_file:
+                chunk = parsed_file.read(chunk_size)
+                end_of_file = not chunk
+                buffer += chunk
 
-# process each company's data
-for company_name in dataset.keys():
-    for report_year in dataset[company_name]:
-        print(f"Processing {company_name}, {report_year}")
+            # locate the start of the array of records
+            if position is None:
+                key_position = buffer.find('"parsed_pages"')
+                array_position = buffer.find('[', key_position) if key_position != -1 else -1
+                if array_position == -1:
+                    if end_of_file:
+                        return
+                    continue
+                position = array_position + 1
 
-        # paths for input and cleaned output
-        source_path = os.path.join('parsed', company_name, f"{report_year}.json")
-        cleaned_output_path = os.path.join('cleaned', company_name, f"{report_year}.json")
+            # decode every complete record in the buffer
+            while True:
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position < len(buffer) and buffer[position] == ']':
+                    return
+                try:
+                    record, position = json_decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # the record continues in the next piece of the file
+                    break
+                yield record
 
-        # skip processing if the cleaned file already exists
-        if os.path.exists(cleaned_output_path):
+            if end_of_file:
+                return
+            buffer = buffer[position:]
+            position = 0
+
+
+# function to decode the JSON objects of an extracted block
+# valid objects are salvaged one at a time, so a truncated or partially invalid array still yields
+# every object before the point where it breaks
+def iter_block_objects(block):
+    array_position = block.find('[')
+    object_position = block.find('{')
+    if array_position == -1 or (object_position != -1 and object_position < array_position):
+        # a single object rather than a list of them
+        if object_position == -1:
+            return
+        try:
+            value, _ = json_decoder.raw_decode(block, object_position)
+        except json.JSONDecodeError:
+            return
+        if isinstance(value, dict):
+            yield value
+        return
+
+    position = array_position + 1
+    while True:
+        while position < len(block) and block[position] in ' \t\r\n,':
+            position += 1
+        if position >= len(block) or block[position] == ']':
+            return
+        try:
+            value, position = json_decoder.raw_decode(block, position)
+        except json.JSONDecodeError:
+            # the rest of the block is cut off or invalid
+            metrics.increment('cleaner_blocks_truncated')
+            return
+        if isinstance(value, dict):
+            yield value
+
+
+# function to extract the entries of every fenced block of a response
+def iter_response_entries(response):
+    for match in FENCED_BLOCK_PATTERN.finditer(response):
+        yield from iter_block_objects(match.group(1))
+
+
+# function to normalize a text for matching, lowercase with single spaces
+def normalize_text(text):
+    return ' '.join(text.lower().split())
+
+
+# function to attribute an entry to the pages of the sentences it was extracted from
+# sentences is a list of (page_number, normalized sentence) pairs, the pages of those mentioning the entry's
+# value are kept, an entry whose value isn't found in any sentence keeps every page of the response
+def entry_pages(item, sentences):
+    value = normalize_text(str(item.get('value', '')))
+    pages = []
+    if len(value) > 1 and value != 'none':
+        pages = [page_number for page_number, sentence in sentences if value in sentence]
+    if not pages:
+        pages = [page_number for page_number, _ in sentences]
+    return list(dict.fromkeys(pages))
+
+
+# function to stream the cleaned entries of a parsed report
+def iter_cleaned_entries(source_path, report_year):
+    entry_id = 0 # unique ID for each entry in the dataset
+    for page_record in iter_parsed_records(source_path):
+        # records carry the LLM response along with the numbers of its source pages,
+        # and since chunks pack several pages, the sentences sent with the page of each
+        source_pages = None
+        sources = None
+        page_content = page_record
+        if isinstance(page_record, dict):
+            source_pages = page_record['pages'] if 'pages' in page_record else [page_record['page']]
+            page_content = page_record['response']
+            if 'sources' in page_record:
+                sources = (page_record['sources'], page_record['sentences'])
+
+        # pages that were retried in halves hold a list of sub-page responses, each with its own sentences
+        if page_content is None:
+            metrics.increment('cleaner_records_without_response')
             continue
+        if isinstance(page_content, list):
+            sub_page_contents = page_content
+            sub_page_sources = list(zip(*sources)) if sources else [None] * len(page_content)
+        else:
+            sub_page_contents = [page_content]
+            sub_page_sources = [sources]
+
+        for sub_page_content, sub_page_source in zip(sub_page_contents, sub_page_sources):
+            sentences = None
+            if sub_page_source is not None:
+                sentences = [(page_number, normalize_text(sentence)) for page_number, sentence in zip(*sub_page_source)]
+            for item in iter_response_entries(sub_page_content):
+                item["id"] = f"{report_year}.{entry_id}"
+                if sentences:
+                    item["pages"] = entry_pages(item, sentences)
+                elif source_pages is not None:
+                    item["pages"] = source_pages
+                entry_id += 1
+                yield item
+
+
+# function to clean a parsed report into an NDJSON file, one entry per line
+# entries are written as they are extracted and the file is renamed into place once complete
+def clean_report(company_name, report_year):
+    source_path = os.path.join('parsed', company_name, f"{report_year}.json")
+    cleaned_output_path = os.path.join('cleaned', company_name, f"{report_year}.ndjson")
+
+    # make sure the parent directory for cleaned data exists
+    os.makedirs(os.path.dirname(cleaned_output_path), exist_ok=True)
+
+    entry_count = 0
+    with atomic_open(cleaned_output_path, 'w') as cleaned_file, metrics.timer('report_seconds', stage='clean'):
+        for item in tqdm.tqdm(iter_cleaned_entries(source_path, report_year)):
+            cleaned_file.write(json.dumps(item) + '\n')
+            entry_count += 1
+    metrics.increment('cleaned_entries', entry_count)
+    return entry_count
+
+
+# function to list the reports without a cleaned file
+def pending_reports(dataset):
+    return [
+        (company_name, report_year)
+        for company_name in dataset.keys()
+        for report_year in dataset[company_name]
+        if not os.path.exists(os.path.join('cleaned', company_name, f"{report_year}.ndjson"))
+    ]
+
+
+def main():
+    # load the dataset from the database file
+    with open("database.json", 'r') as database_file:
+        dataset = json.load(database_file)
+
+    reports = pending_reports(dataset)
+    if not reports:
+        print("No reports to clean.")
+        return
+
+    with instrumented_run('data_cleaner'):
+        # create the 'cleaned' directory
+        os.makedirs('cleaned', exist_ok=True)
+
+        # process each report
+        for company_name, report_year in reports:
+            print(f"Processing {company_name}, {report_year}")
+            clean_report(company_name, report_year)
+
 
-        # make sure the parent directory for cleaned data exists
-        cleaned_parent_dir = os.path.join('cleaned', company_name)
-        if not os.path.exists(cleaned_parent_dir):
-            os.mkdir(cleaned_parent_dir)
-
-        cleaned_data = []
-
-        # load parsed data
-        with open(source_path, 'r') as parsed_file:
-            parsed_pages = json.load(parsed_file)
-
-        # process pages and extract cleaned data
-        entry_id = 0 # unique ID for each entry in the dataset
-        for page_content in parsed_pages['parsed_pages']:
-            if isinstance(page_content, list):
-                combined_entries = []
-                # loops through each sub_page_content in the page_content (which is a list of sub-pages)
-                for sub_page_content in page_content:
-                    extracted = extract_substring(sub_page_content, '```start', 'end```')
-                    if extracted:
-                        try:
-                            parsed = json.loads(extracted)
-                            for item in parsed:
-                                item["id"] = f"{report_year}.{entry_id}"
-                                entry_id += 1
-                            combined_entries.extend(parsed)
-                        except json.JSONDecodeError:
-                            pass
-                cleaned_data.extend(combined_entries)
-            else:
-                extracted = extract_substring(page_content, '```start', 'end```')
-                if extracted:
-                    try:
-                        parsed = json.loads(extracted)
-                        for item in parsed:
-                            item["id"] = f"{report_year}.{entry_id}"
-                            entry_id += 1
-                        cleaned_data.extend(parsed)
-                    except json.JSONDecodeError:
-                        pass
-
-        # Save cleaned data to the output file
-        with open(cleaned_output_path, 'w') as cleaned_file:
-            json.dump(cleaned_data, cleaned_file)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from storage import atomic_open, iter_ndjson
+from instrumentation import metrics, instrumented_run
+
+# topics an entry can belong to, and the spellings the model sometimes uses for them
+TOPICS = ["E", "S", "G"]
+TOPIC_ALIASES = {
+    "environmental": "E", "environment": "E",
+    "social": "S",
+    "governance": "G",
+}
+
+# multipliers written out after a number, e.g. "2.5 million"
+MULTIPLIERS = {
+    "thousand": 1e3,
+    "million": 1e6, "mm": 1e6,
+    "billion": 1e9, "bn": 1e9,
+    "trillion": 1e12,
+}
+
+# currency symbols and the unit they stand for
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY"}
+
+# matches a leading number, with an optional currency symbol, thousands separators and multiplier
+NUMBER_PATTERN = re.compile(
+    r"^\s*(?P<sign>[-+])?\s*(?P<currency>[$€£¥])?\s*"
+    r"(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+)"
+    r"\s*(?P<multiplier>thousand|million|billion|trillion|mm|bn)?\b\s*(?P<unit>.*?)\s*$",
+    re.IGNORECASE,
+)
+
+# columnar layout of the normalized entries
+# low-cardinality columns are dictionary encoded so every distinct value is stored once
+NORMALIZED_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("company", pa.dictionary(pa.int32(), pa.string())),
+    ("year", pa.int16()),
+    ("topic", pa.dictionary(pa.int8(), pa.string())),
+    ("metric", pa.bool_()),
+    ("value_raw", pa.string()),
+    ("value_number", pa.float64()),
+    ("value_unit", pa.dictionary(pa.int32(), pa.string())),
+    ("description", pa.string()),
+    ("tags", pa.list_(pa.dictionary(pa.int32(), pa.string()))),
+    ("pages", pa.list_(pa.int32())),
+])
+
+
+# function to parse a value such as "180,000 metric tons", "$2.5 million" or "70%" into a number and a unit
+# returns (None, None) for values that don't start with a number
+def parse_value(value):
+    if isinstance(value, bool):
+        return None, None
+    if isinstance(value, (int, float)):
+        return float(value), None
+    match = NUMBER_PATTERN.match(str(value))
+    if not match:
+        return None, None
+
+    number = float(match.group('number').replace(',', ''))
+    if match.group('sign') == '-':
+        number = -number
+    multiplier = match.group('multiplier')
+    unit = match.group('unit') or None
+    # "mm" only means millions after a currency symbol ($5MM), otherwise it is millimetres
+    if multiplier and multiplier.lower() == 'mm' and not match.group('currency'):
+        unit = f"{multiplier} {unit}" if unit else multiplier
+        multiplier = None
+    if multiplier:
+        number *= MULTIPLIERS[multiplier.lower()]
+
+    if unit == '%' or (unit and unit.lower() in ('percent', 'per cent')):
+        unit = 'percent'
+    if match.group('currency'):
+        unit = CURRENCY_SYMBOLS[match.group('currency')] if not unit else f"{CURRENCY_SYMBOLS[match.group('currency')]} {unit}"
+    return number, unit
+
+
+# function to normalize the topic of an entry to "E", "S" or "G", None if it is not a valid topic
+def normalize_topic(topic):
+    if not isinstance(topic, str):
+        return None
+    topic = topic.strip()
+    if topic.upper() in TOPICS:
+        return topic.upper()
+    return TOPIC_ALIASES.get(topic.lower())
+
+
+# function to normalize the metric flag of an entry to a bool
+def normalize_metric(metric, value_number):
+    if isinstance(metric, bool):
+        return metric
+    if isinstance(metric, str) and metric.strip().lower() in ('true', 'false'):
+        return metric.strip().lower() == 'true'
+    # without a usable flag, an entry is a metric when its value is a number
+    return value_number is not None
+
+
+# function to normalize the tags of an entry to a list of distinct lowercase strings
+def normalize_tags(tags):
+    if isinstance(tags, str):
+        tags = [tags]
+    if not isinstance(tags, list):
+        return []
+    normalized = []
+    for tag in tags:
+        if isinstance(tag, str) and tag.strip() and tag.strip().lower() not in normalized:
+            normalized.append(tag.strip().lower())
+    return normalized
+
+
+# function to validate and normalize a cleaned entry
+# returns the normalized entry, or None with the reason the entry was rejected
+def normalize_entry(entry, company_name, report_year):
+    if not isinstance(entry, dict):
+        return None, 'not an object'
+    description = entry.get('description')
+    if not isinstance(description, str) or not description.strip():
+        return None, 'missing description'
+    topic = normalize_topic(entry.get('topic'))
+    if topic is None:
+        return None, 'invalid topic'
+
+    value = entry.get('value')
+    value_number, value_unit = parse_value(value)
+    pages = entry.get('pages') or []
+    return {
+        'id': str(entry.get('id')),
+        'company': company_name,
+        'year': int(report_year),
+        'topic': topic,
+        'metric': normalize_metric(entry.get('metric'), value_number),
+        'value_raw': None if value is None else str(value),
+        'value_number': value_number,
+        'value_unit': value_unit,
+        'description': description.strip(),
+        'tags': normalize_tags(entry.get('tags')),
+        'pages': [page for page in pages if isinstance(page, int)],
+    }, None
+
+
+# function to normalize the cleaned entries of a report into a Parquet file
+# returns the number of entries written and the number rejected by reason
+def normalize_report(company_name, report_year):
+    source_path = os.path.join('cleaned', company_name, f"{report_year}.ndjson")
+    output_path = os.path.join('normalized', company_name, f"{report_year}.parquet")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    columns = {field.name: [] for field in NORMALIZED_SCHEMA}
+    rejected = {}
+    for entry in iter_ndjson(source_path):
+        normalized, reason = normalize_entry(entry, company_name, report_year)
+        if normalized is None:
+            rejected[reason] = rejected.get(reason, 0) + 1
+            continue
+        for name, value in normalized.items():
+            columns[name].append(value)
+
+    table = pa.table(columns, schema=NORMALIZED_SCHEMA)
+    with atomic_open(output_path, 'wb') as output_file:
+        pq.write_table(table, output_file, compression='zstd')
+    metrics.increment('normalized_entries', table.num_rows)
+    for reason, count in rejected.items():
+        metrics.increment('normalizer_rejected_entries', count, reason=reason)
+    return table.num_rows, rejected
+
+
+# function to read a column subset of a normalized report, without touching the other columns
+def read_normalized(company_name, report_year, columns=None):
+    return pq.read_table(os.path.join('normalized', company_name, f"{report_year}.parquet"), columns=columns)
+
+
+# function to list the reports without a normalized file
+def pending_reports(dataset):
+    return [
+        (company_name, report_year)
+        for company_name in dataset.keys()
+        for report_year in dataset[company_name]
+        if not os.path.exists(os.path.join('normalized', company_name, f"{report_year}.parquet"))
+    ]
+
+
+def main():
+    # load the dataset from the database file
+    with open("database.json", 'r') as database_file:
+        dataset = json.load(database_file)
+
+    reports = pending_reports(dataset)
+    if not reports:
+        print("No reports to normalize.")
+        return
+
+    with instrumented_run('data_normalizer'):
+        # create the 'normalized' directory
+        os.makedirs('normalized', exist_ok=True)
+
+        # process each report
+        for company_name, report_year in reports:
+            print(f"Processing {company_name}, {report_year}")
+            written, rejected = normalize_report(company_name, report_year)
+            print(f"Normalized {written} entries, rejected {sum(rejected.values())} {rejected}")
+
+
+if __name__ == '__main__':
+    main()
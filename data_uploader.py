@@ -1,109 +1,229 @@
 import os
 from dotenv import load_dotenv
 import json
-import time
+import threading
 import tqdm
 from pymongo import MongoClient
-from pymongo.errors import CollectionInvalid
-from pinecone import Pinecone, ServerlessSpec
-from langchain.embeddings import OpenAIEmbeddings
+from embedding_engine import BatchedEmbedder, EmbeddingCache, embedding_model_name, get_embedding_model
+from storage import iter_ndjson
+from mongo_writer import delete_entries, ensure_indexes
+from upload_pipeline import UploadPipeline
+from upload_manifest import UploadManifest, file_hash
+from vector_store import get_vector_store
+from instrumentation import metrics, instrumented_run
 
 load_dotenv()
 
-# initialize embeddings
-embedding_model = OpenAIEmbeddings(model="text-embedding-ada-002") #  used to generate vector embeddings for the company metrics descriptions
-
-# MongoDB 
-mongo_uri = os.getenv("MONGO_URI")  
-mongo_client = MongoClient(mongo_uri)  
-db = mongo_client["sustainability_db"]
-
-# ensure the collection exists in MongoDB 
-try:
-    collection = db["company_metrics"]
-    collection.insert_one({"_id": "test_document"})
-    collection.delete_one({"_id": "test_document"})  
-except CollectionInvalid:
-    # If collection doesn't exist, it will automatically be created during insertions
-    collection = db["company_metrics"]
-
-# Pinecone API initialization
-PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
-PINECONE_ENV = os.getenv('PINECONE_ENV')  
-PINECONE_INDEX_NAME = "company-key-data"
-
-# create an instance of the Pinecone class
-pc = Pinecone(api_key=PINECONE_API_KEY)
-
-# ensure Pinecone index exists
-if PINECONE_INDEX_NAME not in [index.name for index in pc.list_indexes()]:
-    pc.create_index(
-        name=PINECONE_INDEX_NAME,
-        dimension=1536,
-        metric='cosine',
-        spec=ServerlessSpec(
-            cloud='aws',  
-            region=PINECONE_ENV  
+# batch sizes for embedding requests and uploads
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 100))
+UPLOAD_BATCH_SIZE = int(os.getenv('UPLOAD_BATCH_SIZE', 100))
+MONGO_BATCH_SIZE = int(os.getenv('MONGO_BATCH_SIZE', 1000))
+
+# concurrent workers per upload stage, and the number of batches queued between stages
+EMBED_WORKERS = int(os.getenv('EMBED_WORKERS', 2))
+VECTOR_WORKERS = int(os.getenv('VECTOR_WORKERS', 4))
+MONGO_WORKERS = int(os.getenv('MONGO_WORKERS', 2))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 8))
+
+# manifest of the uploaded entries, so a run only pushes what changed since the last one
+# set FULL_UPLOAD=1 to ignore it and upload every entry again
+UPLOAD_MANIFEST_PATH = os.getenv('UPLOAD_MANIFEST_PATH', 'upload_manifest.json')
+FULL_UPLOAD = os.getenv('FULL_UPLOAD', '0') == '1'
+
+# upload backends, created by get_backends the first time an upload runs
+embedder = None
+collection = None
+vector_store = None
+backends_lock = threading.Lock()
+
+# uploads read and rewrite the manifest, so they run one at a time
+upload_lock = threading.Lock()
+
+
+# function to get the embedder, MongoDB collection and vector store, creating them on first use
+def get_backends():
+    global embedder, collection, vector_store
+    with backends_lock:
+        if embedder is None:
+            # initialize embeddings
+            # used to generate vector embeddings for the company metrics descriptions, batched and cached on disk
+            # so re-uploads and repeated descriptions are never embedded twice
+            embedding_model, embedding_model_name = get_embedding_model()
+            embedding_cache = EmbeddingCache(os.getenv('EMBEDDING_CACHE_PATH', 'embeddings_cache.sqlite'))
+            embedder = BatchedEmbedder(embedding_model, embedding_model_name, cache=embedding_cache,
+                                       batch_size=EMBEDDING_BATCH_SIZE)
+
+            # MongoDB
+            mongo_uri = os.getenv("MONGO_URI")
+            mongo_client = MongoClient(mongo_uri)
+            db = mongo_client["sustainability_db"]
+
+            # the collection is created with its query indexes up front
+            collection = db["company_metrics"]
+            ensure_indexes(collection)
+
+            # vector store, the serverless Pinecone index by default or the local on-disk store with VECTOR_STORE=local
+            vector_store = get_vector_store()
+        return embedder, vector_store, collection
+
+
+# function to load the upload manifest
+# the manifest is tied to the embedding model and vector store, switching either uploads everything again
+# both are read from the settings, so the manifest can be checked before any backend is created
+def load_manifest():
+    manifest = UploadManifest(UPLOAD_MANIFEST_PATH, {
+        'embedding_model': embedding_model_name(),
+        'vector_store': os.getenv('VECTOR_STORE', 'pinecone'),
+    })
+    if FULL_UPLOAD:
+        manifest.reports = {}
+    return manifest
+
+
+# function to list the reports whose cleaned file changed since the last upload, and the uploaded reports
+# that are no longer in the database
+def pending_uploads(company_data):
+    manifest = load_manifest()
+    changed = []
+    for company_name in company_data:
+        for report_year in company_data[company_name]:
+            cleaned_data_path = os.path.join('cleaned', company_name, f"{report_year}.ndjson")
+            if os.path.exists(cleaned_data_path) and \
+                    not manifest.is_unchanged(company_name, report_year, file_hash(cleaned_data_path)):
+                changed.append((company_name, report_year))
+    dropped = [(company_name, report_year) for company_name, report_year in manifest.uploaded_reports()
+               if report_year not in company_data.get(company_name, [])]
+    return changed, dropped
+
+
+# function to delete the vectors and documents of entries by their company-year-id keys
+def delete_uploaded(keys):
+    if keys:
+        vector_store.delete(keys)
+        delete_entries(collection, keys, MONGO_BATCH_SIZE)
+        metrics.increment('upload_entries_deleted', len(keys))
+    return len(keys)
+
+
+# function to upload the new and changed entries of a list of (company_name, report_year) reports
+# unchanged files are skipped without being parsed, and entries removed from a file are deleted
+# returns the stage stats, the number of skipped reports and deleted entries, and the failed batches and deletes
+def upload_reports(reports, progress=None):
+    get_backends()
+    with upload_lock:
+        manifest = load_manifest()
+
+        # manifest records of the reports sent through the pipeline, written once their upload succeeded
+        pending_records = {}
+        counts = {'skipped_reports': 0, 'deleted_entries': 0}
+        # reports whose removed entries couldn't be deleted, left out of the manifest like failed batches
+        delete_failures = []
+
+        def iter_changed_reports():
+            for company_name, report_year in reports:
+                cleaned_data_path = os.path.join('cleaned', company_name, f"{report_year}.ndjson")
+
+                try:
+                    source_hash = file_hash(cleaned_data_path)
+                except FileNotFoundError:
+                    print(f"Cleaned data file not found for {company_name}, {report_year}. Skipping.")
+                    continue
+                if manifest.is_unchanged(company_name, report_year, source_hash):
+                    counts['skipped_reports'] += 1
+                    metrics.increment('upload_reports_unchanged')
+                    continue
+
+                print(f"Processing: {company_name}, {report_year}")
+                # load cleaned data, one entry per line
+                cleaned_entries = list(iter_ndjson(cleaned_data_path))
+                changed_entries, removed_keys, entry_hashes = manifest.diff(company_name, report_year, cleaned_entries)
+                try:
+                    counts['deleted_entries'] += delete_uploaded(removed_keys)
+                except Exception as error:
+                    delete_failures.append((company_name, report_year, error))
+                    metrics.increment('upload_delete_failures')
+                    continue
+                metrics.increment('upload_entries_unchanged', len(cleaned_entries) - len(changed_entries))
+                pending_records[(company_name, report_year)] = (source_hash, entry_hashes)
+                if changed_entries:
+                    yield company_name, report_year, changed_entries
+
+        # embedding, vector upserts and MongoDB writes run concurrently as a pipeline,
+        # so the upload is limited by the slowest backend rather than the sum of all three
+        pipeline = UploadPipeline(
+            embedder, vector_store, collection,
+            upload_batch_size=UPLOAD_BATCH_SIZE,
+            mongo_batch_size=MONGO_BATCH_SIZE,
+            embed_workers=EMBED_WORKERS,
+            vector_workers=VECTOR_WORKERS,
+            mongo_workers=MONGO_WORKERS,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            progress=progress,
         )
-    )
-
-pinecone_index = pc.Index(PINECONE_INDEX_NAME)
-
-# load company data from the database
-with open("database.json", 'r') as database_file:
-    company_data = json.load(database_file)
-
-# batch size for uploads
-UPLOAD_BATCH_SIZE = 1
-
-# process each company's data
-for company_name in company_data.keys():
-    for report_year in company_data[company_name]:
-        print(f"Processing: {company_name}, {report_year}")
-        cleaned_data_path = os.path.join('cleaned', company_name, f"{report_year}.json")
-
-        # load cleaned data
-        try:
-            with open(cleaned_data_path, 'r') as cleaned_file:
-                cleaned_entries = json.load(cleaned_file)
-        except FileNotFoundError:
-            print(f"Cleaned data file not found for {company_name}, {report_year}. Skipping.")
-            continue
-
-        # initialize containers for documents and entries
-        document_batch = []
-        mongo_entries = []
-
-        # process entries in the cleaned data
-        for entry in tqdm.tqdm(cleaned_entries):
-            entry['year'] = report_year
-            entry['company'] = company_name
-
-            mongo_entries.append(entry)
-            vector_id = f"{company_name}-{report_year}-{entry.get('id')}"
-            document_batch.append({
-                "id": vector_id,
-                "values": embedding_model.embed_query(entry.get("description", "")),  # Ensure description exists
-                "metadata": entry
-            })
-
-            # upload in batches to Pinecone and MongoDB
-            if len(document_batch) >= UPLOAD_BATCH_SIZE:
-                # upload batch to Pinecone
-                pinecone_index.upsert(vectors=document_batch)
-                document_batch = []
-
-                # upload batch to MongoDB
-                if mongo_entries:
-                    collection.insert_many(mongo_entries) 
-                mongo_entries = []
-
-        # upload remaining entries to Pinecone
-        if document_batch:
-            pinecone_index.upsert(vectors=document_batch)
-
-        # upload remaining entries to MongoDB
-        if mongo_entries:
-            collection.insert_many(mongo_entries)
-
-        time.sleep(0.1)
+        stage_stats = pipeline.run(iter_changed_reports())
+        vector_store.save()
+
+        # reports with a failed batch stay out of the manifest, so the next run uploads their changes again
+        failures = delete_failures + pipeline.failures()
+        failed_reports = {(company_name, report_year) for company_name, report_year, _ in failures}
+        for (company_name, report_year), (source_hash, entry_hashes) in pending_records.items():
+            if (company_name, report_year) not in failed_reports:
+                manifest.record(company_name, report_year, source_hash, entry_hashes)
+        manifest.save()
+    return dict(counts, pipeline=stage_stats, failures=failures)
+
+
+# function to delete the entries of uploaded reports that are no longer in the database
+# returns the number of deleted entries
+# the backends are only created when there is something to delete
+def remove_dropped_reports(company_data):
+    deleted = 0
+    with upload_lock:
+        manifest = load_manifest()
+        dropped = [(company_name, report_year) for company_name, report_year in manifest.uploaded_reports()
+                   if report_year not in company_data.get(company_name, [])]
+        if not dropped:
+            return 0
+        get_backends()
+        for company_name, report_year in dropped:
+            print(f"Removing: {company_name}, {report_year}")
+            # a report whose entries couldn't all be deleted stays in the manifest, so the next run deletes them again
+            try:
+                deleted += delete_uploaded(manifest.uploaded_keys(company_name, report_year))
+            except Exception as error:
+                print(f"Failed to remove {company_name}, {report_year}: {error}")
+                metrics.increment('upload_delete_failures')
+                continue
+            manifest.forget(company_name, report_year)
+        vector_store.save()
+        manifest.save()
+    return deleted
+
+
+def main():
+    # load company data from the database
+    with open("database.json", 'r') as database_file:
+        company_data = json.load(database_file)
+
+    # when nothing changed since the last upload, exit before connecting to the embedding model, MongoDB or the
+    # vector store
+    changed, dropped = pending_uploads(company_data)
+    if not changed and not dropped:
+        print("No changes to upload.")
+        return
+
+    with instrumented_run('data_uploader'):
+        with tqdm.tqdm(unit='entries') as progress:
+            result = upload_reports(changed, progress=progress.update)
+        deleted_entries = result['deleted_entries'] + remove_dropped_reports(company_data)
+
+        print(f"Pipeline: {result['pipeline']}")
+        unchanged_reports = sum(len(report_years) for report_years in company_data.values()) - len(changed)
+        print(f"Skipped {unchanged_reports} unchanged reports, deleted {deleted_entries} removed entries.")
+        print(f"Embedded {embedder.embedded} descriptions in {embedder.requests} requests ({embedder.cache_hits} cache hits).")
+        for company_name, report_year, error in result['failures']:
+            print(f"Failed upload for {company_name}, {report_year}: {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,16 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 import os
 import json
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import atomic_write_json
+from report_store import ReportStore
+from instrumentation import metrics, instrumented_run
 
 # companies to fetch reports for
 companies = [
@@ -12,8 +21,20 @@ companies = [
 OLDEST_YEAR = 2023
 
 # base URLs used for constructing search and report URLs
-BASE_SEARCH_URL = "https://www.responsibilityreports.com/Companies?search="
-BASE_REPORT_URL = "https://www.responsibilityreports.com"
+# REPORTS_BASE_URL points the crawler at another host, such as a local stand-in server
+BASE_REPORT_URL = os.getenv('REPORTS_BASE_URL', "https://www.responsibilityreports.com")
+BASE_SEARCH_URL = f"{BASE_REPORT_URL}/Companies?search="
+
+# crawler settings
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 8))  # companies processed concurrently
+MAX_REQUESTS_PER_HOST = int(os.getenv('DOWNLOAD_MAX_PER_HOST', 4))  # requests in flight per host
+REQUEST_TIMEOUT = (10, 60)  # connect and read timeouts, in seconds
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1.0  # retries wait 1s, 2s, 4s, ...
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# refresh runs revisit companies that are already in the database to pick up new and changed reports
+REFRESH = os.getenv('REFRESH', '0') == '1'
 
 # load previously stored data if available
 data_file = 'database.json'
@@ -22,6 +43,54 @@ if os.path.exists(data_file):
     with open(data_file, 'r') as f:
         data = json.load(f)
 
+# guards data, which is shared by the threads processing companies
+data_lock = threading.Lock()
+
+# HTTP session shared by all threads, so connections are pooled and reused
+session = None
+session_lock = threading.Lock()
+
+# semaphores limiting the number of requests in flight to each host
+host_semaphores = {}
+
+# content-addressed store of the downloaded PDFs and their HTTP validators
+report_store = ReportStore('data')
+
+
+# function to get the shared HTTP session, retrying failed requests with backoff
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            retry = Retry(
+                total=MAX_RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET", "HEAD"],
+            )
+            adapter = HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+
+# function to get the semaphore limiting concurrent requests to the host of a URL
+def host_semaphore(url):
+    host = urlparse(url).netloc
+    with session_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(MAX_REQUESTS_PER_HOST)
+        return host_semaphores[host]
+
+
+# function to fetch a page, within the per-host limit
+def fetch_page(url):
+    with host_semaphore(url), metrics.timer('http_request_seconds', kind='page'):
+        response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response
+
 # function to construct the full search URL
 def construct_search_url(company_name):
     return f"{BASE_SEARCH_URL}{company_name}"
@@ -37,7 +106,7 @@ def process_company(company_name):
     os.makedirs('data', exist_ok=True)
 
     # fetch the search page for the company
-    search_response = requests.get(construct_search_url(company_name))
+    search_response = fetch_page(construct_search_url(company_name))
     search_soup = BeautifulSoup(search_response.text, 'html.parser')
     # print(search_soup)
 
@@ -50,18 +119,18 @@ def process_company(company_name):
     company_link = company_element.find('a')
     company_title = company_link.text.strip()
 
-    # skip if the company is already processed
-    if company_title in data:
-        print(f"{company_title} already processed.")
-        return
-
+    # skip if the company is already processed, unless this is a refresh run
     # initialize data storage for the company
-    data[company_title] = []
+    with data_lock:
+        if company_title in data and not REFRESH:
+            print(f"{company_title} already processed.")
+            return
+        data.setdefault(company_title, [])
     company_url = construct_full_url(company_link['href'])
     print(company_url)
 
     # fetch the company's main page
-    company_response = requests.get(company_url)
+    company_response = fetch_page(company_url)
     company_soup = BeautifulSoup(company_response.text, 'html.parser')
     # print(company_soup)
 
@@ -111,20 +180,57 @@ def process_company(company_name):
         print(f"Failed to download archived reports for {company_title}: {e}")
 
 # function to save a report PDF locally
+# the PDF is streamed into the content-addressed report store and linked to data/<company>/<year>.pdf,
+# so the whole report is never buffered in memory and an interrupted download leaves nothing behind
+# reports that were downloaded before are fetched with a conditional GET and skipped when unchanged
 def save_report(relative_url, year, directory, company_title):
     report_url = construct_full_url(relative_url)
-    response = requests.get(report_url)
     file_name = f"{year}.pdf"
     file_path = os.path.join(directory, file_name)
-    with open(file_path, 'wb') as report_file:
-        report_file.write(response.content)
-    data[company_title].append(year)
-    print(f"Saved report for {company_title} ({year}).")
-
-# process each company in the list
-for company in companies:
-    process_company(company)
-
-# save the updated data to the database file
-with open(data_file, 'w') as f:
-    json.dump(data, f, indent=4)
+    with host_semaphore(report_url), metrics.timer('http_request_seconds', kind='report'):
+        headers = report_store.conditional_headers(report_url)
+        with get_session().get(report_url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True) as response:
+            if response.status_code == 304:
+                sha256 = report_store.mark_not_modified(report_url)
+            else:
+                response.raise_for_status()
+                sha256 = report_store.store(report_url, response.iter_content(DOWNLOAD_CHUNK_SIZE), response.headers)
+    report_store.link(sha256, file_path)
+    with data_lock:
+        if year not in data[company_title]:
+            data[company_title].append(year)
+    metrics.increment('reports_fetched', status='not_modified' if response.status_code == 304 else 'downloaded')
+    if response.status_code == 304:
+        print(f"Report for {company_title} ({year}) unchanged.")
+    else:
+        print(f"Saved report for {company_title} ({year}).")
+
+
+# function to process a company, reporting failures instead of stopping the other companies
+def process_company_safely(company_name):
+    try:
+        process_company(company_name)
+    except Exception as e:
+        print(f"Failed to process {company_name}: {e}")
+        metrics.increment('companies_failed')
+
+
+# function to process a list of companies concurrently
+def process_companies(company_names, num_workers=DOWNLOAD_WORKERS):
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        list(pool.map(process_company_safely, company_names))
+
+
+def main():
+    with instrumented_run('database_gen'):
+        # process each company in the list
+        process_companies(companies)
+
+        # save the updated data to the database file and the HTTP validators of the downloaded reports
+        atomic_write_json(data_file, data, indent=4)
+        report_store.save()
+        print(f"Report store: {report_store.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import random
+import hashlib
+import threading
+
+import numpy as np
+
+from storage import atomic_write_json
+
+# near-duplicate detection run before pages are sent to the LLM
+# repeated sentences of a report (headers, footers, boilerplate disclaimers) are dropped after their first occurrence,
+# and pages near-identical to a page already parsed from an earlier report of the same company are suppressed
+# sentences or pages whose numbers differ are never treated as duplicates, since those carry the year's new metrics
+
+# 'off' sends every sentence of every page
+DEDUP_MODE = os.getenv('DEDUP_MODE', 'on')
+
+# directory of the per-company signature indexes of parsed pages
+INDEX_DIR = os.getenv('DEDUP_INDEX_DIR', 'dedup')
+
+# number of words per shingle
+SHINGLE_SIZE = 3
+
+# sentences whose 64-bit SimHashes differ in at most this many bits are duplicates
+SIMHASH_DISTANCE = int(os.getenv('DEDUP_SIMHASH_DISTANCE', 3))
+
+# pages whose estimated Jaccard similarity reaches this threshold are duplicates
+PAGE_SIMILARITY = float(os.getenv('DEDUP_PAGE_SIMILARITY', 0.9))
+
+# MinHash signature length, split into LSH bands to find candidate pages without comparing against all of them
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+
+# pages with fewer words than this are left to sentence dedup, their shingle sets are too small to compare
+MIN_PAGE_WORDS = 20
+
+# the MinHash permutations are fixed, so signatures stored by earlier runs stay comparable
+# hashes are reduced modulo a 31-bit prime so the products of the permutations fit in 64-bit integers
+MERSENNE_PRIME = (1 << 31) - 1
+_rng = random.Random(0)
+PERMUTATION_A = np.array([_rng.randrange(1, MERSENNE_PRIME) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64)
+PERMUTATION_B = np.array([_rng.randrange(0, MERSENNE_PRIME) for _ in range(MINHASH_PERMUTATIONS)], dtype=np.uint64)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+
+# the index of a company is read and rewritten by one report at a time
+index_lock = threading.Lock()
+
+
+def hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+# function to normalize a text into its lowercase words
+def words(text):
+    return WORD_PATTERN.findall(text.lower())
+
+
+# function to fingerprint the numbers of a text, texts with different numbers are never duplicates
+def numbers_key(text):
+    return hashlib.sha256(' '.join(NUMBER_PATTERN.findall(text)).encode('utf-8')).hexdigest()[:16]
+
+
+def shingles(tokens, size=SHINGLE_SIZE):
+    if len(tokens) <= size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[index:index + size]) for index in range(len(tokens) - size + 1)}
+
+
+# function to compute the 64-bit SimHash of a sentence over its words and word pairs
+def simhash(tokens):
+    features = tokens + [' '.join(pair) for pair in zip(tokens, tokens[1:])]
+    digests = np.frombuffer(b''.join(hash64(feature).to_bytes(8, 'big') for feature in features), dtype=np.uint8)
+    # a bit of the SimHash is set when it is set in the majority of the feature hashes
+    bits = np.unpackbits(digests).reshape(len(features), 64).sum(axis=0) * 2 > len(features)
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+# function to compute the MinHash signature of a set of shingles
+def minhash(shingle_set):
+    hashes = np.array([hash64(shingle) % MERSENNE_PRIME for shingle in shingle_set], dtype=np.uint64)
+    permuted = (np.outer(PERMUTATION_A, hashes) + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+    return permuted.min(axis=1).tolist()
+
+
+def estimated_similarity(signature, other):
+    return sum(1 for first, second in zip(signature, other) if first == second) / len(signature)
+
+
+def lsh_keys(signature, bands=LSH_BANDS):
+    rows = len(signature) // bands
+    return [f"{band}:{hash64(' '.join(map(str, signature[band * rows:(band + 1) * rows])))}" for band in range(bands)]
+
+
+class SentenceFilter:
+    """
+    Drops sentences near-identical to one already seen in the same report, found through SimHash.
+    The 64 bits are split into blocks, two hashes within SIMHASH_DISTANCE bits of each other share at least one block.
+    """
+
+    def __init__(self, distance=SIMHASH_DISTANCE):
+        self.distance = distance
+        self.blocks = distance + 1
+        self.width = 64 // self.blocks
+        self.buckets = {}
+
+    def block_keys(self, value, numbers):
+        mask = (1 << self.width) - 1
+        return [(block, value >> (block * self.width) & mask, numbers) for block in range(self.blocks)]
+
+    def is_duplicate(self, sentence):
+        tokens = words(sentence)
+        if not tokens:
+            return True
+        value = simhash(tokens)
+        keys = self.block_keys(value, numbers_key(sentence))
+        for key in keys:
+            for seen in self.buckets.get(key, ()):
+                if bin(value ^ seen).count('1') <= self.distance:
+                    return True
+        for key in keys:
+            self.buckets.setdefault(key, []).append(value)
+        return False
+
+
+class SignatureIndex:
+    """
+    MinHash signatures of the parsed pages of a company's reports, stored in <INDEX_DIR>/<company>.json,
+    with LSH buckets to look up the pages of earlier years a new page may duplicate.
+    """
+
+    def __init__(self, company_name, index_dir=INDEX_DIR):
+        self.path = os.path.join(index_dir, f"{company_name}.json")
+        self.pages = {}  # "year/page" -> {'signature': [...], 'numbers': ...}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as index_file:
+                self.pages = json.load(index_file)['pages']
+        self.buckets = {}
+        for key, page in self.pages.items():
+            for bucket in lsh_keys(page['signature']):
+                self.buckets.setdefault(bucket, []).append(key)
+
+    # function to find a page of a year before report_year that the page duplicates
+    def find_duplicate(self, report_year, signature, numbers):
+        candidates = {key for bucket in lsh_keys(signature) for key in self.buckets.get(bucket, ())}
+        for key in sorted(candidates):
+            page = self.pages[key]
+            if int(key.split('/')[0]) >= int(report_year) or page['numbers'] != numbers:
+                continue
+            if estimated_similarity(signature, page['signature']) >= PAGE_SIMILARITY:
+                return key
+        return None
+
+    # function to replace the pages recorded for a year with the pages just parsed
+    def record(self, report_year, page_signatures):
+        self.pages = {key: page for key, page in self.pages.items() if key.split('/')[0] != str(report_year)}
+        for page_number, (signature, numbers) in page_signatures.items():
+            self.pages[f"{report_year}/{page_number}"] = {'signature': signature, 'numbers': numbers}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        atomic_write_json(self.path, {'pages': self.pages})
+
+
+# function to compute the signature of a page, None for pages too short to compare
+def page_signature(sentences):
+    tokens = words(' '.join(sentences))
+    if len(tokens) < MIN_PAGE_WORDS:
+        return None
+    return minhash(shingles(tokens)), numbers_key(' '.join(sentences))
+
+
+# function to deduplicate the pages of a report, a list of (page_number, sentences) pairs
+# returns the (page_number, sentences) pairs left to parse, the signatures of the pages to record once the report
+# is parsed, and counts of what was dropped
+def deduplicate_pages(company_name, report_year, pages, index_dir=INDEX_DIR):
+    with index_lock:
+        index = SignatureIndex(company_name, index_dir)
+    sentence_filter = SentenceFilter()
+    kept = []
+    signatures = {}
+    stats = {'sentences_dropped': 0, 'pages_suppressed': 0}
+    for page_number, sentences in pages:
+        signature = page_signature(sentences)
+        if signature is not None:
+            signatures[page_number] = signature
+            if index.find_duplicate(report_year, *signature):
+                stats['pages_suppressed'] += 1
+                continue
+        unique = [sentence for sentence in sentences if not sentence_filter.is_duplicate(sentence)]
+        stats['sentences_dropped'] += len(sentences) - len(unique)
+        if unique:
+            kept.append((page_number, unique))
+    return kept, signatures, stats
+
+
+# function to fingerprint the pages recorded for a company's reports before report_year,
+# which decide the pages suppressed in that report
+def index_digest(company_name, report_year, index_dir=INDEX_DIR):
+    with index_lock:
+        index = SignatureIndex(company_name, index_dir)
+    earlier = {key: page for key, page in index.pages.items() if int(key.split('/')[0]) < int(report_year)}
+    return hashlib.sha256(json.dumps(earlier, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# function to add the pages of a parsed report to the company's signature index
+def record_pages(company_name, report_year, signatures, index_dir=INDEX_DIR):
+    with index_lock:
+        index = SignatureIndex(company_name, index_dir)
+        index.record(report_year, signatures)
+        index.save()
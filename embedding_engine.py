@@ -0,0 +1,163 @@
+import os
+import time
+import array
+import hashlib
+import sqlite3
+import threading
+
+from instrumentation import metrics
+
+# dimension of text-embedding-ada-002 vectors, matches the Pinecone index
+EMBEDDING_DIMENSION = 1536
+
+# name of the OpenAI embedding model used in production
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+# function to build the cache key for a piece of text
+# the model name is part of the key so switching models never returns stale vectors
+def content_hash(text, model_name):
+    return hashlib.sha256(f"{model_name}\x00{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk cache of embedding vectors keyed by content hash."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self.connection.commit()
+
+    def get_many(self, keys):
+        # returns a dict of key -> vector for the keys that are cached
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            # sqlite limits the number of bound parameters, so look keys up in slices
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                )
+                for key, blob in rows:
+                    vector = array.array('f')
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+        return found
+
+    def put_many(self, items):
+        # items is an iterable of (key, vector) pairs
+        rows = [(key, array.array('f', vector).tobytes()) for key, vector in items]
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+            )
+            self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class FakeEmbeddings:
+    """Deterministic local stand-in for OpenAIEmbeddings, used for offline benchmarks."""
+
+    def __init__(self, dimension=EMBEDDING_DIMENSION, latency=0.0, per_text_latency=0.0):
+        self.dimension = dimension
+        self.latency = latency  # simulated round trip per request
+        self.per_text_latency = per_text_latency  # simulated cost per embedded text
+        self.calls = 0
+
+    def _vector(self, text):
+        # derive a stable unit vector from the text so equal inputs embed equally
+        digest = hashlib.shake_256(text.encode('utf-8')).digest(self.dimension * 2)
+        values = array.array('h')
+        values.frombytes(digest)
+        norm = sum(value * value for value in values) ** 0.5 or 1.0
+        return [value / norm for value in values]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        delay = self.latency + self.per_text_latency * len(texts)
+        if delay:
+            time.sleep(delay)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class BatchedEmbedder:
+    """Embeds texts in batches through embed_documents, skipping anything already cached."""
+
+    def __init__(self, model, model_name, cache=None, batch_size=100):
+        self.model = model
+        self.model_name = model_name
+        self.cache = cache
+        self.batch_size = batch_size
+        self.cache_hits = 0
+        self.embedded = 0
+        self.requests = 0
+        self.lock = threading.Lock()  # guards the counters, embed may be called from several threads
+
+    def embed(self, texts):
+        # returns one vector per input text, in input order
+        keys = [content_hash(text, self.model_name) for text in texts]
+
+        # repeated descriptions only need to be embedded once
+        unique = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+
+        vectors = self.cache.get_many(unique.keys()) if self.cache is not None else {}
+        cache_hits = sum(1 for key in keys if key in vectors)
+        with self.lock:
+            self.cache_hits += cache_hits
+        metrics.increment('embedding_cache_hits', cache_hits)
+
+        missing = [key for key in unique if key not in vectors]
+        for start in range(0, len(missing), self.batch_size):
+            batch_keys = missing[start:start + self.batch_size]
+            with metrics.timer('embedding_request_seconds', model=self.model_name):
+                batch_vectors = self.model.embed_documents([unique[key] for key in batch_keys])
+            metrics.increment('embedded_texts', len(batch_keys))
+            with self.lock:
+                self.requests += 1
+                self.embedded += len(batch_keys)
+            new_vectors = dict(zip(batch_keys, batch_vectors))
+            if self.cache is not None:
+                self.cache.put_many(new_vectors.items())
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+
+# function to build the embedding model selected by the EMBEDDING_BACKEND environment variable
+# 'openai' (default) uses OpenAIEmbeddings, 'fake' uses the deterministic local backend
+def get_embedding_model(backend=None):
+    backend = backend or os.getenv('EMBEDDING_BACKEND', 'openai')
+    if backend == 'fake':
+        return FakeEmbeddings(latency=float(os.getenv('FAKE_EMBEDDING_LATENCY', 0))), embedding_model_name(backend)
+    if backend == 'openai':
+        from langchain.embeddings import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=OPENAI_EMBEDDING_MODEL), embedding_model_name(backend)
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+# function to get the name of the embedding model of a backend without creating the model
+def embedding_model_name(backend=None):
+    backend = backend or os.getenv('EMBEDDING_BACKEND', 'openai')
+    if backend == 'fake':
+        return 'fake'
+    if backend == 'openai':
+        return OPENAI_EMBEDDING_MODEL
+    raise ValueError(f"Unknown embedding backend: {backend}")
@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import cProfile
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from storage import atomic_open, atomic_write_json
+
+# directory the run reports and profiles are written to
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+
+# profiler wrapped around a script run: '' (none), 'cprofile' or 'py-spy'
+PROFILER = os.getenv('PROFILE', '')
+
+# number of observations kept per timer to estimate its percentiles
+TIMER_SAMPLES = 1024
+
+# prefix of the exported Prometheus metric names
+PROMETHEUS_PREFIX = 'greenify_'
+
+
+# function to combine uniform samples of count and other_count observations into a uniform sample of them all,
+# taking from each sample in proportion to the number of observations it stands for
+def merge_samples(samples, count, other_samples, other_count):
+    if len(samples) + len(other_samples) <= TIMER_SAMPLES:
+        return samples + other_samples
+    taken = round(TIMER_SAMPLES * count / (count + other_count))
+    taken = min(len(samples), max(TIMER_SAMPLES - len(other_samples), taken))
+    return random.sample(samples, taken) + random.sample(other_samples, TIMER_SAMPLES - taken)
+
+
+class Metrics:
+    """
+    Counters and timers shared by the threads of a run, labelled like Prometheus metrics.
+    Timers keep their count, sum and maximum, and a uniform sample of their observations for percentiles.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def increment(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            timer = self.timers.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0, 'samples': []})
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            # reservoir sampling keeps every observation equally likely to be in the sample
+            if len(timer['samples']) < TIMER_SAMPLES:
+                timer['samples'].append(seconds)
+            else:
+                index = random.randrange(timer['count'])
+                if index < TIMER_SAMPLES:
+                    timer['samples'][index] = seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        # starts over with no metrics and a new lock, in a worker process forked while another thread held the old one
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def drain(self):
+        # returns the metrics recorded so far and resets them, to ship them out of a worker process
+        with self.lock:
+            snapshot = {'counters': self.counters, 'timers': self.timers}
+            self.counters = {}
+            self.timers = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        # adds the metrics drained from another process
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in snapshot['timers'].items():
+                timer = self.timers.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0, 'samples': []})
+                timer['samples'] = merge_samples(timer['samples'], timer['count'], other['samples'], other['count'])
+                timer['count'] += other['count']
+                timer['sum'] += other['sum']
+                timer['max'] = max(timer['max'], other['max'])
+
+    def summary(self):
+        # returns the metrics as a JSON-serializable run summary
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted((key, dict(timer, samples=sorted(timer['samples']))) for key, timer in self.timers.items())
+        return {
+            'started': self.started,
+            'duration_seconds': round(time.time() - self.started, 3),
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in counters],
+            'timers': [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': timer['count'],
+                    'sum': round(timer['sum'], 6),
+                    'max': round(timer['max'], 6),
+                    'p50': percentile(timer['samples'], 0.5),
+                    'p95': percentile(timer['samples'], 0.95),
+                    'p99': percentile(timer['samples'], 0.99),
+                }
+                for (name, labels), timer in timers
+            ],
+        }
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        # returns the metrics in the Prometheus text exposition format
+        # counters are exported as <name>_total, timers as summaries with 0.5, 0.95 and 0.99 quantiles
+        summary = self.summary()
+        lines = []
+        typed = set()
+        for counter in summary['counters']:
+            name = f"{prefix}{counter['name']}_total"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{format_labels(counter['labels'])} {counter['value']}")
+        for timer in summary['timers']:
+            name = f"{prefix}{timer['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            for quantile, field in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                lines.append(f"{name}{format_labels(dict(timer['labels'], quantile=quantile))} {timer[field]}")
+            lines.append(f"{name}_sum{format_labels(timer['labels'])} {timer['sum']}")
+            lines.append(f"{name}_count{format_labels(timer['labels'])} {timer['count']}")
+        lines.append(f"# TYPE {prefix}run_duration_seconds gauge")
+        lines.append(f"{prefix}run_duration_seconds {summary['duration_seconds']}")
+        return '\n'.join(lines) + '\n'
+
+
+# function to get a percentile of sorted samples, None without samples
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    return round(samples[min(len(samples) - 1, int(fraction * len(samples)))], 6)
+
+
+# function to format Prometheus labels, escaping the characters the format reserves
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+# metrics of the current process, shared by every module
+metrics = Metrics()
+
+
+# function to write the run report of a script: a timestamped JSON summary, kept so runs can be compared,
+# and the latest Prometheus text file, which node_exporter's textfile collector can pick up
+# returns the path of the JSON summary
+def write_run_report(script_name, directory=METRICS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    summary_path = os.path.join(directory, f"{script_name}-{timestamp}.json")
+    atomic_write_json(summary_path, dict(metrics.summary(), script=script_name), indent=2)
+    with atomic_open(os.path.join(directory, f"{script_name}.prom"), 'w') as prometheus_file:
+        prometheus_file.write(metrics.to_prometheus())
+    return summary_path
+
+
+# context manager to profile a block with the profiler selected by PROFILE
+# cProfile writes a .prof file for pstats or snakeviz, py-spy samples this process and its workers into a flame graph
+@contextmanager
+def profiled(script_name, profiler=PROFILER, directory=METRICS_DIR):
+    if not profiler:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    output_base = os.path.join(directory, f"{script_name}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(output_base + '.prof')
+            print(f"Profile written to {output_base}.prof")
+        return
+
+    if profiler == 'py-spy':
+        if shutil.which('py-spy') is None:
+            print("py-spy is not installed, running without profiling", file=sys.stderr)
+            yield
+            return
+        recorder = subprocess.Popen(['py-spy', 'record', '--subprocesses', '--pid', str(os.getpid()),
+                                     '--output', output_base + '.svg'])
+        try:
+            yield
+        finally:
+            # py-spy writes the flame graph when it is interrupted
+            recorder.send_signal(signal.SIGINT)
+            recorder.wait()
+            print(f"Flame graph written to {output_base}.svg")
+        return
+
+    raise ValueError(f"Unknown profiler: {profiler}")
+
+
+# context manager wrapping the run of a script: profiles it, times it as a whole and writes its run report,
+# even when the run fails
+@contextmanager
+def instrumented_run(script_name):
+    try:
+        with profiled(script_name), metrics.timer('run_seconds', script=script_name):
+            yield metrics
+    finally:
+        print(f"Run report: {write_run_report(script_name)}")
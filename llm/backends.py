@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from llm.response_cache import CacheMiss, ResponseCache
+from llm.scheduler import charge_extra_request, is_rate_limit_error
+from llm.together_textgen import MODEL_NAME, SAMPLING_PARAMETERS, get_language_model, get_response_cache
+from instrumentation import metrics, percentile
+
+# models the parser sends its requests to, as a JSON list of objects with
+#   provider: 'together', or 'stub' for the offline fake model
+#   model: the provider's model name (default: MODEL_NAME)
+#   weight: share of the requests routed to it (default: 1)
+#   max_concurrency: requests in flight at once (default: 4)
+#   and for stubs latency, slow_fraction, slow_latency and failure_rate
+# e.g. [{"provider": "together", "weight": 3}, {"provider": "together", "model": "mistralai/Mixtral-8x7B-Instruct-v0.1"}]
+# defaults to the single Together model
+BACKENDS_CONFIG = os.getenv('LLM_BACKENDS', '[{"provider": "together"}]')
+
+# a request still running after this long is duplicated on another backend and the first answer wins
+# a number of seconds, or p50/p90/p95/p99 for that percentile of the backend's recent latencies, empty to never hedge
+HEDGE_AFTER = os.getenv('LLM_HEDGE_AFTER', '')
+
+# latencies a backend needs before a percentile hedge delay is used
+HEDGE_MIN_SAMPLES = 20
+
+# consecutive failures that open a backend's circuit, and how long it stays open before a trial request
+CIRCUIT_FAILURES = int(os.getenv('LLM_CIRCUIT_FAILURES', 5))
+CIRCUIT_RESET_SECONDS = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', 30))
+
+# number of recent latencies every backend keeps for its percentiles
+LATENCY_WINDOW = 1000
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a backend after `failures` consecutive failures. Once `reset_seconds` have passed,
+    the circuit is half-open and admits a single trial request: a success closes the circuit, a failure keeps it
+    open for another `reset_seconds`.
+    """
+
+    def __init__(self, failures=CIRCUIT_FAILURES, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def available(self):
+        # returns whether a request would be admitted, without admitting it
+        with self.lock:
+            if self.state == 'open':
+                return time.monotonic() - self.opened_at >= self.reset_seconds
+            return self.state == 'closed'
+
+    def acquire(self):
+        # admits a request, the first one after the circuit has been open for reset_seconds being its trial
+        with self.lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half-open'
+                return True
+            return self.state == 'closed'
+
+    def release(self):
+        # gives back a trial that was never sent or ended without telling whether the backend works,
+        # so the next request is admitted as the trial instead
+        with self.lock:
+            if self.state == 'half-open':
+                self.state = 'open'
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        # returns True when the failure opened the circuit
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == 'half-open':
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            elif self.state == 'closed' and self.consecutive_failures >= self.failures:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class Backend:
+    """A model behind a provider, with its own concurrency limit, circuit breaker and latency window."""
+
+    def __init__(self, name, model_name, model, parameters, weight=1.0, max_concurrency=4):
+        self.name = name
+        self.model_name = model_name
+        self.model = model
+        self.parameters = parameters
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.breaker = CircuitBreaker()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.failures = 0
+
+    def cache_key(self, prompt):
+        return ResponseCache.make_key(self.model_name, self.parameters, prompt)
+
+    def has_capacity(self):
+        with self.lock:
+            return self.in_flight < self.max_concurrency
+
+    def latency_percentile(self, fraction):
+        with self.lock:
+            return percentile(sorted(self.latencies), fraction)
+
+    def invoke(self, prompt):
+        with self.lock:
+            self.in_flight += 1
+        try:
+            with self.slots:
+                start = time.perf_counter()
+                try:
+                    response = self.model.invoke(prompt)
+                except Exception as error:
+                    with self.lock:
+                        self.failures += 1
+                    metrics.increment('llm_backend_failures', backend=self.name)
+                    # a quota error means the backend is busy, not broken, the scheduler backs off for those
+                    if is_rate_limit_error(error):
+                        self.breaker.release()
+                    elif self.breaker.record_failure():
+                        print(f"Circuit opened for LLM backend {self.name}: {error}")
+                        metrics.increment('llm_circuit_opened', backend=self.name)
+                    raise
+                latency = time.perf_counter() - start
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        self.breaker.record_success()
+        with self.lock:
+            self.calls += 1
+            self.latencies.append(latency)
+        metrics.observe('llm_backend_seconds', latency, backend=self.name)
+        return response
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            calls, failures = self.calls, self.failures
+        return {
+            'calls': calls, 'failures': failures, 'circuit': self.breaker.state,
+            'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99),
+        }
+
+
+class Router:
+    """
+    Sends every request to one of its backends, picked at random by weight among those whose circuit admits it,
+    preferring backends with a free slot. A failed request is retried on another backend, and a request that takes
+    longer than the hedge delay is duplicated on another backend, the first answer being returned.
+    Retries and hedges are charged to the rate limits of the scheduler call the request is part of, and a request
+    is only hedged while those limits have room for it.
+    """
+
+    def __init__(self, backends, hedge_after=HEDGE_AFTER, seed=None):
+        self.backends = backends
+        self.hedge_after = hedge_after
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+        # room for every backend's full concurrency, once for the requests and once for their hedges
+        self.pool = ThreadPoolExecutor(max_workers=2 * sum(backend.max_concurrency for backend in backends))
+
+    def pick(self, exclude=(), require_capacity=False):
+        # returns a backend admitted by its circuit breaker, passing over those whose trial request was just taken
+        exclude = list(exclude)
+        while True:
+            candidates = [backend for backend in self.backends if backend not in exclude and backend.breaker.available()]
+            with_capacity = [backend for backend in candidates if backend.has_capacity()]
+            if require_capacity or with_capacity:
+                candidates = with_capacity
+            if not candidates:
+                return None
+            with self.rng_lock:
+                backend = self.rng.choices(candidates, weights=[backend.weight for backend in candidates])[0]
+            if backend.breaker.acquire():
+                return backend
+            exclude.append(backend)
+
+    def hedge_delay(self, backend):
+        # returns the seconds to wait before hedging a request sent to backend, None to never hedge it
+        if not self.hedge_after:
+            return None
+        if self.hedge_after.startswith('p'):
+            if len(backend.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return backend.latency_percentile(float(self.hedge_after[1:]) / 100)
+        return float(self.hedge_after)
+
+    def generate(self, prompt):
+        # returns the response and the backend that produced it
+        backend = self.pick()
+        if backend is None:
+            raise RuntimeError("Every LLM backend's circuit is open")
+        tried = [backend]
+        pending = {self.pool.submit(backend.invoke, prompt): backend}
+        hedge_delay = self.hedge_delay(backend)
+        hedge = None
+        last_error = None
+        while pending:
+            done, _ = wait(pending, timeout=hedge_delay if hedge is None else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # the request is slower than the hedge delay, duplicate it on a backend with a free slot
+                # as long as the rate limits have room for it right away
+                hedge = self.pick(exclude=tried, require_capacity=True) or False
+                if hedge and not charge_extra_request(wait=False):
+                    hedge.breaker.release()
+                    hedge = False
+                if hedge:
+                    tried.append(hedge)
+                    pending[self.pool.submit(hedge.invoke, prompt)] = hedge
+                    self.hedges += 1
+                    metrics.increment('llm_hedged_requests', backend=hedge.name)
+                continue
+            for future in done:
+                answered = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as error:
+                    last_error = error
+                    if pending:
+                        continue
+                    # fail over to a backend that hasn't been tried for this request
+                    retry = self.pick(exclude=tried)
+                    if retry is not None:
+                        charge_extra_request()
+                        tried.append(retry)
+                        pending[self.pool.submit(retry.invoke, prompt)] = retry
+                        metrics.increment('llm_failovers', backend=retry.name)
+                    continue
+                if hedge and answered is hedge:
+                    self.hedge_wins += 1
+                    metrics.increment('llm_hedge_wins', backend=answered.name)
+                return response, answered
+        raise last_error
+
+    def stats(self):
+        return {
+            'backends': {backend.name: backend.stats() for backend in self.backends},
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+        }
+
+
+# function to create the model of a backend configuration
+# returns the model name, the model and the parameters that are part of the cache key
+def create_model(config):
+    provider = config.get('provider', 'together')
+    if provider == 'together':
+        model_name = config.get('model', MODEL_NAME)
+        return model_name, LazyTogetherModel(model_name), SAMPLING_PARAMETERS
+    if provider == 'stub':
+        from llm.fake_textgen import MODEL_NAME as STUB_MODEL_NAME, FakeLanguageModel
+        options = {key: config[key] for key in ('latency', 'slow_fraction', 'slow_latency', 'failure_rate', 'seed')
+                   if key in config}
+        return config.get('model', STUB_MODEL_NAME), FakeLanguageModel(**options), {}
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+class LazyTogetherModel:
+    """Together model created on its first request, so cached runs never build the client."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def invoke(self, prompt):
+        return get_language_model(self.model_name).invoke(prompt)
+
+
+# function to create the backends of a configuration, a list of dicts as described for LLM_BACKENDS
+def create_backends(configs):
+    backends = []
+    for config in configs:
+        model_name, model, parameters = create_model(config)
+        name = config.get('name', f"{config.get('provider', 'together')}:{model_name}")
+        backends.append(Backend(name, model_name, model, parameters, weight=float(config.get('weight', 1)),
+                                max_concurrency=int(config.get('max_concurrency', 4))))
+    return backends
+
+
+# the router, created on first use
+router = None
+router_lock = threading.Lock()
+
+
+def get_router():
+    global router
+    with router_lock:
+        if router is None:
+            router = Router(create_backends(json.loads(BACKENDS_CONFIG)))
+        return router
+
+
+# function to look up the recorded response of any configured backend for a prompt
+# returns None if the prompt has not been answered yet, or raises CacheMiss when replaying read-only
+def cached_text(user_prompt, context_prompt=""):
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return None
+    prompt = context_prompt + '\n' + user_prompt
+    for backend in get_router().backends:
+        response = response_cache.get(backend.cache_key(prompt))
+        if response is not None:
+            return response
+    if response_cache.read_only:
+        raise CacheMiss(f"No recorded response for prompt {get_router().backends[0].cache_key(prompt)}")
+    return None
+
+
+# function to route a prompt to one of the backends without looking at the cache, recording its response
+# under the model that answered
+def generate_text(user_prompt, context_prompt=""):
+    prompt = context_prompt + '\n' + user_prompt
+    response, backend = get_router().generate(prompt)
+    response_cache = get_response_cache()
+    if response_cache is not None and not response_cache.read_only:
+        response_cache.put(backend.cache_key(prompt), response)
+    return response
@@ -0,0 +1,83 @@
+from llm.tokens import count_tokens
+
+# tokens taken by the quotes, comma and space around every sentence when a chunk is formatted as a list
+SENTENCE_OVERHEAD_TOKENS = 2
+
+
+# function to build a chunk from a list of (page_number, sentence) pairs
+# a chunk is a dict holding its key, the pages it came from, its sentences and the source page of each sentence
+def make_chunk(key, sources):
+    pages = []
+    for page_number, _ in sources:
+        if page_number not in pages:
+            pages.append(page_number)
+    return {
+        'key': key,
+        'pages': pages,
+        'sentences': [sentence for _, sentence in sources],
+        'sources': [page_number for page_number, _ in sources],
+    }
+
+
+# function to split the sentences of a page into parts that each fit the token budget
+# a single sentence longer than the budget becomes a part of its own
+def split_sentences(sentences, budget, token_counter=count_tokens):
+    parts = []
+    current = []
+    current_tokens = 0
+    for sentence in sentences:
+        tokens = token_counter(sentence) + SENTENCE_OVERHEAD_TOKENS
+        if current and current_tokens + tokens > budget:
+            parts.append(current)
+            current = []
+            current_tokens = 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        parts.append(current)
+    return parts
+
+
+# function to turn the pages of a report into chunks that fit a token budget
+# consecutive short pages are packed into one chunk, pages over the budget are split on sentence boundaries
+# pages is a list of (page_number, sentences) pairs
+def chunk_pages(pages, budget, token_counter=count_tokens):
+    chunks = []
+    packed = []
+    packed_tokens = 0
+
+    def flush():
+        nonlocal packed, packed_tokens
+        if packed:
+            page_numbers = sorted({page_number for page_number, _ in packed})
+            chunks.append(make_chunk('+'.join(str(page_number) for page_number in page_numbers), packed))
+        packed = []
+        packed_tokens = 0
+
+    for page_number, sentences in pages:
+        page_tokens = sum(token_counter(sentence) + SENTENCE_OVERHEAD_TOKENS for sentence in sentences)
+        if page_tokens > budget:
+            # long pages are split into parts of their own
+            flush()
+            for part_index, part in enumerate(split_sentences(sentences, budget, token_counter)):
+                chunks.append(make_chunk(f"{page_number}.{part_index}", [(page_number, sentence) for sentence in part]))
+            continue
+        if packed_tokens + page_tokens > budget:
+            flush()
+        packed.extend((page_number, sentence) for sentence in sentences)
+        packed_tokens += page_tokens
+    flush()
+    return chunks
+
+
+# function to split a chunk into two halves on a sentence boundary, used to retry chunks that failed
+# returns a single chunk if it only holds one sentence
+def split_chunk(chunk):
+    sources = list(zip(chunk['sources'], chunk['sentences']))
+    if len(sources) < 2:
+        return [chunk]
+    middle = len(sources) // 2
+    return [
+        make_chunk(f"{chunk['key']}/0", sources[:middle]),
+        make_chunk(f"{chunk['key']}/1", sources[middle:]),
+    ]
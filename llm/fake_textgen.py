@@ -0,0 +1,96 @@
+import os
+import re
+import ast
+import json
+import time
+import random
+import hashlib
+import threading
+
+# deterministic stand-in for the TogetherAI model, used by the benchmarks to run the parser offline
+# it answers the extraction prompt with one point per input sentence that mentions a number
+
+MODEL_NAME = "fake-extractor"
+
+# simulated latency of a request, and of every generated point
+LATENCY = float(os.getenv('FAKE_LLM_LATENCY', 0))
+PER_POINT_LATENCY = float(os.getenv('FAKE_LLM_PER_POINT_LATENCY', 0))
+
+# markers around the sentence list of the prompt, the last "```start ... end```" block before the output section
+INPUT_START = "```start"
+INPUT_END = "end```## Output"
+
+# matches the first number of a sentence and the word after it
+VALUE_PATTERN = re.compile(r"\$?\d[\d,]*(?:\.\d+)?(?:\s+(?:percent|million|billion|metric tons|hours|cubic meters))?")
+
+TOPIC_KEYWORDS = {
+    "E": ("emission", "renewable", "energy", "waste", "water", "co2", "climate"),
+    "S": ("women", "employee", "community", "training", "safety", "diversity"),
+    "G": ("board", "director", "audit", "ethics", "governance"),
+}
+
+
+class FakeLanguageModel:
+    """
+    Deterministic language model answering the extraction prompt, with `invoke` like the LangChain models.
+    A fraction of the requests can be made slow, or fail, to stand in for a provider's tail latency and outages.
+    """
+
+    def __init__(self, latency=LATENCY, per_point_latency=PER_POINT_LATENCY, slow_fraction=0.0, slow_latency=0.0,
+                 failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.per_point_latency = per_point_latency
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    @staticmethod
+    def extract_points(prompt):
+        end = prompt.rfind(INPUT_END)
+        start = prompt.rfind(INPUT_START, 0, end)
+        if end == -1 or start == -1:
+            return []
+        try:
+            sentences = ast.literal_eval(prompt[start + len(INPUT_START):end].strip())
+        except (ValueError, SyntaxError):
+            return []
+        points = []
+        for sentence in sentences:
+            value = VALUE_PATTERN.search(sentence)
+            if not value:
+                continue
+            lowered = sentence.lower()
+            topic = next((topic for topic, words in TOPIC_KEYWORDS.items() if any(word in lowered for word in words)),
+                         "ESG"[int(hashlib.sha256(sentence.encode('utf-8')).hexdigest(), 16) % 3])
+            points.append({
+                "value": value.group(0),
+                "metric": True,
+                "topic": topic,
+                "description": sentence.strip(),
+                "tags": sorted({word for words in TOPIC_KEYWORDS.values() for word in words if word in lowered}),
+            })
+        return points
+
+    def invoke(self, prompt):
+        points = self.extract_points(prompt)
+        with self.lock:
+            self.calls += 1
+            slow = self.rng.random() < self.slow_fraction
+            failed = self.rng.random() < self.failure_rate
+        latency = (self.slow_latency if slow else self.latency) + self.per_point_latency * len(points)
+        if latency:
+            time.sleep(latency)
+        if failed:
+            raise RuntimeError("Fake model failure")
+        return "```start\n" + json.dumps(points, indent=4) + "\nend```"
+
+
+language_model = FakeLanguageModel()
+
+
+# function to invoke the fake model, with the same signature as llm.backends.generate_text
+def generate_text(user_prompt, context_prompt=""):
+    return language_model.invoke(context_prompt + '\n' + user_prompt)
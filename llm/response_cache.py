@@ -0,0 +1,114 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+class CacheMiss(Exception):
+    """Raised in read-only mode when a prompt has no recorded response."""
+
+
+# function to hash a prompt
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Disk-backed cache of LLM responses keyed by model, sampling parameters and prompt hash.
+    Least recently used responses are evicted once the cache grows past max_entries or max_bytes.
+    In read-only mode the file is never written, so a whole run can be replayed against recorded responses.
+    """
+
+    def __init__(self, path, max_entries=100000, max_bytes=512 * 1024 * 1024, read_only=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self.connection.commit()
+
+        self.entries, self.total_bytes = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    @staticmethod
+    def make_key(model, parameters, prompt):
+        # the key covers everything that changes the response: model, sampling parameters and prompt
+        return hashlib.sha256(json.dumps(
+            {'model': model, 'parameters': parameters, 'prompt': prompt_hash(prompt)}, sort_keys=True
+        ).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        # returns the cached response, or None on a miss
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.connection.commit()
+            return row[0]
+
+    def put(self, key, response):
+        if self.read_only:
+            raise CacheMiss("Cannot record responses in a read-only cache")
+        size = len(response.encode('utf-8'))
+        with self.lock:
+            previous = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            if previous:
+                self.total_bytes -= previous[0]
+            else:
+                self.entries += 1
+            self.total_bytes += size
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        # drop the least recently used responses until the cache is back within its bounds
+        while self.entries > self.max_entries or self.total_bytes > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.entries <= self.max_entries and self.total_bytes <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.entries -= 1
+                self.total_bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': self.entries,
+            'bytes': self.total_bytes,
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
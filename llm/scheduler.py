@@ -0,0 +1,187 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from llm.tokens import count_tokens
+from instrumentation import metrics
+
+
+class TokenBucket:
+    """Token bucket that refills continuously at `rate` tokens per second, up to `capacity` tokens."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        # a request larger than the bucket could never be served, so it waits for a full bucket instead
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, amount=1):
+        # takes the tokens only if they are available right away, returns whether they were taken
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def release(self, amount=1):
+        # returns tokens taken for a request that was never sent
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limits calls in flight, halving the limit on rate limit errors and growing it back one step at a time."""
+
+    def __init__(self, max_limit, min_limit=1, increase_after=10):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self.increase_after = increase_after  # successful calls needed before the limit grows by one
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.increase_after and self.limit < self.max_limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def on_rate_limit(self):
+        with self.condition:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self.successes = 0
+
+
+# the scheduler and token count of the call running on the current thread, so the requests a call sends besides its
+# own (the router's hedges and failovers) are charged to the same rate limits
+active_call = threading.local()
+
+
+# function to check whether an error is the provider rejecting a request for exceeding its quota
+def is_rate_limit_error(error):
+    status_code = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    message = str(error).lower()
+    return status_code == 429 or '429' in message or 'rate limit' in message or 'too many requests' in message
+
+
+class LLMScheduler:
+    """
+    Runs LLM calls on a bounded thread pool, limited by requests per second and tokens per minute,
+    with a concurrency limit that backs off when the provider answers with 429s.
+    """
+
+    def __init__(self, requests_per_second, tokens_per_minute, max_concurrency,
+                 max_retries=5, retry_backoff=1.0, token_counter=count_tokens):
+        self.request_bucket = TokenBucket(requests_per_second, max(1, requests_per_second))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.limiter = AdaptiveConcurrencyLimiter(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.token_counter = token_counter
+        self.rate_limited = 0
+
+    def call(self, function, prompt, completion_tokens=0):
+        # calls function(prompt) once the rate limits allow it, retrying with exponential backoff on 429s
+        # any other error is raised to the caller
+        tokens = self.token_counter(prompt) + completion_tokens
+        for attempt in range(self.max_retries + 1):
+            # time spent waiting on the concurrency limit and the rate limits before the call goes out
+            with metrics.timer('llm_wait_seconds'):
+                self.limiter.acquire()
+            try:
+                with metrics.timer('llm_wait_seconds'):
+                    self.request_bucket.acquire()
+                    self.token_bucket.acquire(tokens)
+                active_call.scheduler, active_call.tokens = self, tokens
+                try:
+                    result = function(prompt)
+                finally:
+                    active_call.scheduler = None
+            except Exception as error:
+                if not is_rate_limit_error(error) or attempt == self.max_retries:
+                    raise
+                self.rate_limited += 1
+                metrics.increment('llm_rate_limited')
+                self.limiter.on_rate_limit()
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                self.limiter.release()
+            time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def charge(self, tokens, wait=True):
+        # charges one more request of `tokens` tokens against the rate limits, returns whether it was charged
+        # without waiting, it is only charged if the limits allow it right away and the concurrency limit
+        # isn't backing off from 429s
+        if wait:
+            with metrics.timer('llm_wait_seconds'):
+                self.request_bucket.acquire()
+                self.token_bucket.acquire(tokens)
+            return True
+        if self.limiter.limit < self.limiter.max_limit or not self.request_bucket.try_acquire():
+            return False
+        if not self.token_bucket.try_acquire(tokens):
+            self.request_bucket.release()
+            return False
+        return True
+
+    def map(self, task, items, progress=None):
+        # runs task(item) for every item on the pool and returns the results in input order
+        # progress is an optional callback invoked after each finished item
+        def run(item):
+            result = task(item)
+            if progress:
+                progress()
+            return result
+
+        # if an item fails, the items that have not started yet are cancelled instead of run to completion
+        pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            return list(pool.map(run, items))
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+
+# function to charge a request sent besides the call running on the current thread against its scheduler's limits
+# returns whether it was charged, requests sent outside of a scheduler call have nothing to be charged to
+def charge_extra_request(wait=True):
+    scheduler = getattr(active_call, 'scheduler', None)
+    if scheduler is None:
+        return True
+    return scheduler.charge(active_call.tokens, wait)
@@ -1,20 +1,61 @@
-from langchain_together import Together
 import os
+import threading
 from dotenv import load_dotenv
 
+from llm.response_cache import ResponseCache
+
 load_dotenv()
 
+# model served by TogetherAI
+MODEL_NAME = "meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo"
+
+# maximum number of tokens generated per request
+MAX_TOKENS = 1028
+
+# sampling parameters, part of the response cache key
+SAMPLING_PARAMETERS = {
+    'temperature': 0.7,
+    'max_tokens': MAX_TOKENS,
+    'top_k': 1,
+}
+
+# response cache mode: 'readwrite' (default) records every response, 'readonly' replays a run
+# offline against recorded responses, 'off' always calls the model
+CACHE_MODE = os.getenv('LLM_CACHE_MODE', 'readwrite')
+
+# the response cache, opened on first use
+response_cache = None
+response_cache_lock = threading.Lock()
+
+# the llm of every model used, initialized on first use so cached and replayed runs never need the provider
+language_models = {}
+
+
+# function to get the response cache, None when caching is off
+def get_response_cache():
+    global response_cache
+    with response_cache_lock:
+        if response_cache is None and CACHE_MODE != 'off':
+            response_cache = ResponseCache(
+                os.getenv('LLM_CACHE_PATH', 'llm_cache.sqlite'),
+                max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', 100000)),
+                read_only=CACHE_MODE == 'readonly',
+            )
+        return response_cache
 
 
-# initialize the llm
-language_model = Together(
-    model="meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo",
-    temperature=0.7,
-    max_tokens=1028,
-    top_k=1,
-)
+def get_language_model(model_name=MODEL_NAME):
+    if model_name not in language_models:
+        from langchain_together import Together
+        language_models[model_name] = Together(model=model_name, **SAMPLING_PARAMETERS)
+    return language_models[model_name]
 
 
+# function to answer a prompt, from the response cache when it has been answered before
+# goes through the router of llm/backends.py, so responses are cached under the same keys as the parser's
 def text_generator(user_prompt, context_prompt=""):
-    # combine the context prompt and user prompt, and invoke the model
-    return language_model.invoke(context_prompt + '\n' + user_prompt)
+    from llm.backends import cached_text, generate_text
+    response = cached_text(user_prompt, context_prompt)
+    if response is not None:
+        return response
+    return generate_text(user_prompt, context_prompt)
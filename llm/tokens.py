@@ -0,0 +1,47 @@
+import threading
+
+# tiktoken is optional, without it token counts are estimated from the text length
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# rough number of characters per token for English text
+CHARS_PER_TOKEN = 4
+
+# tokenizer used to count tokens, loaded on first use
+TOKENIZER_NAME = "cl100k_base"
+tokenizer = None
+
+# set in place of the tokenizer when it can't be loaded, so the load isn't attempted again for every count
+UNAVAILABLE = object()
+
+
+tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    global tokenizer
+    with tokenizer_lock:
+        if tokenizer is None:
+            tokenizer = UNAVAILABLE
+            if tiktoken is not None:
+                try:
+                    tokenizer = tiktoken.get_encoding(TOKENIZER_NAME)
+                except Exception:
+                    # the encoding could not be loaded (e.g. offline on first use), fall back to estimates
+                    pass
+    return None if tokenizer is UNAVAILABLE else tokenizer
+
+
+# function to name the way tokens are counted, the tokenizer or "estimate"
+def tokenizer_name():
+    return TOKENIZER_NAME if get_tokenizer() is not None else "estimate"
+
+
+# function to count the number of tokens in a piece of text
+def count_tokens(text):
+    encoding = get_tokenizer()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // CHARS_PER_TOKEN)
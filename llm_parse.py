@@ -4,16 +4,36 @@ import os
 # allowing it to import modules from that directory, like llm.together_textgen
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from llm.together_textgen import text_generator as together_text_generator
+from llm.together_textgen import MAX_TOKENS, get_response_cache
+from llm.backends import get_router, cached_text, generate_text as routed_text_generator
+from llm.scheduler import LLMScheduler
+from llm.tokens import count_tokens, tokenizer_name
+from llm.chunking import chunk_pages, split_chunk
+from storage import Journal, atomic_write_json
+import dedup
+from instrumentation import metrics, instrumented_run
 
 import os
 import json
-import tqdm
-import threading
 import time
+import hashlib
+import tqdm
+
+# route requests across the configured LLM backends (TogetherAI's model by default, see llm/backends.py)
+# recorded responses are looked up before scheduling, so cache hits never wait on the rate limits
+generate_text_function = routed_text_generator
+cached_text_function = cached_text
+
+# provider quota the scheduler keeps requests within
+REQUESTS_PER_SECOND = float(os.getenv('LLM_REQUESTS_PER_SECOND', 1))
+TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', 60000))
+
+# maximum number of requests in flight, lowered automatically while the provider returns 429s
+MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
 
-# use TogetherAI's text generation
-generate_text_function = together_text_generator
+# number of page text tokens sent per request, short pages are packed together up to this budget and
+# longer pages are split so the extracted points still fit in the completion
+CHUNK_TOKEN_BUDGET = int(os.getenv('LLM_CHUNK_TOKEN_BUDGET', 600))
 
 # helper function to generate a structured prompt for analysis
 # formats the prompt with the page_data to extract key metrics from the page
@@ -108,67 +128,228 @@ Provide analysis output for the following data, as a JSON list:\n
 ```start""" + str(page_data) + "end```## Output\n"""
 
 
-# create directory for parsed results
-if not os.path.exists('parsed'):
-    os.mkdir('parsed')
-
-# load company data
-with open("database.json", 'r') as database_file:
-    company_data = json.load(database_file)
-
-# process each company's data
-for company_name in company_data.keys():
-    for report_year in company_data[company_name]:
-        print(f"Processing {company_name}, {report_year}")
-
-        # file paths for input and parsed output
-        source_path = os.path.join('text', company_name, f"{report_year}.json")
-        destination_path = os.path.join('parsed', company_name, f"{report_year}.json")
-
-        # skip already processed files
-        if os.path.exists(destination_path):
-            continue
-
-        # ensure parent directories exist
-        parent_directory = os.path.join('parsed', company_name)
-        if not os.path.exists(parent_directory):
-            os.mkdir(parent_directory)
-
-        parsed_results = [] # store the parsed data
-        # reads the input JSON file (source_path), which contains the raw data of the document, 
-        # and loads it into the document_data variable
-        with open(source_path, 'r') as source_file:
-            document_data = json.load(source_file)
-
-        # threaded task to process a page
-        def process_page_in_thread(page_content):
-            try:
-                result = generate_text_function(generate_prompt(page_content))
-                parsed_results.append(result)
-            except Exception as error:
-                print(f"Error processing page: {error}")
-                try:
-                    time.sleep(1.1)
-                    first_half = page_content[:len(page_content) // 2]
-                    second_half = page_content[len(page_content) // 2:]
-                    result_first = generate_text_function(generate_prompt(first_half))
-                    result_second = generate_text_function(generate_prompt(second_half))
-                    parsed_results.append([result_first, result_second])
-                except Exception as retry_error:
-                    print(f"Retry failed for {company_name}, {report_year}: {retry_error}")
-
-        # manage threading for processing document pages
-        threads = []
-        num_threads = 4
-        for batch_index in tqdm.tqdm(range(len(document_data['pages']) // num_threads)):
-            for page in document_data['pages'][batch_index * num_threads:(batch_index + 1) * num_threads]:
-                thread = threading.Thread(target=process_page_in_thread, args=(page,))
-                threads.append(thread)
-                thread.start()
-                time.sleep(1.1)
-            for thread in threads:
-                thread.join()
-
-        # save parsed results
-        with open(destination_path, 'w') as destination_file:
-            json.dump({'parsed_pages': parsed_results}, destination_file)
+# function to run a single prompt through the scheduler
+# returns the response with the prompt hash, latency and token counts of the call
+def run_prompt(scheduler, page_content):
+    prompt = generate_prompt(page_content)
+    timing = {}
+
+    def timed_generate(scheduled_prompt):
+        start = time.perf_counter()
+        result = generate_text_function(scheduled_prompt)
+        timing['latency'] = time.perf_counter() - start
+        return result
+
+    response = cached_text_function(prompt)
+    cached = response is not None
+    if not cached:
+        response = scheduler.call(timed_generate, prompt, MAX_TOKENS)
+        metrics.observe('llm_call_seconds', timing['latency'])
+    else:
+        timing['latency'] = 0.0
+        metrics.increment('llm_cache_hits')
+    stats = {
+        'prompt_hash': hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+        'latency': timing['latency'],
+        'prompt_tokens': count_tokens(prompt),
+        'completion_tokens': count_tokens(response),
+    }
+    # tokens are counted for cached responses too, labelled so the tokens actually billed can be told apart
+    metrics.increment('llm_prompt_tokens', stats['prompt_tokens'], cached=str(cached).lower())
+    metrics.increment('llm_completion_tokens', stats['completion_tokens'], cached=str(cached).lower())
+    return response, stats
+
+
+# function to parse a single chunk of sentences
+# if the request for the whole chunk fails, the chunk is retried as two halves split on a sentence boundary
+# returns a record of the chunk key, its source pages, its sentences with the page of each, the response
+# (None if the chunk failed) and the call statistics
+# the response, sentences and sources of a split chunk are lists holding those of both halves
+def parse_chunk(scheduler, chunk, label):
+    record = {'chunk': chunk['key'], 'pages': chunk['pages'], 'sentences': chunk['sentences'],
+              'sources': chunk['sources'], 'response': None}
+    try:
+        response, stats = run_prompt(scheduler, chunk['sentences'])
+        record['response'] = response
+        record.update(stats)
+    except Exception as error:
+        print(f"Error processing chunk {chunk['key']}: {error}")
+        metrics.increment('llm_chunks_split')
+        halves = split_chunk(chunk)
+        if len(halves) < 2:
+            metrics.increment('llm_chunks_failed')
+            return record
+        try:
+            result_first, stats_first = run_prompt(scheduler, halves[0]['sentences'])
+            result_second, stats_second = run_prompt(scheduler, halves[1]['sentences'])
+            record['response'] = [result_first, result_second]
+            record['sentences'] = [halves[0]['sentences'], halves[1]['sentences']]
+            record['sources'] = [halves[0]['sources'], halves[1]['sources']]
+            record['prompt_hash'] = [stats_first['prompt_hash'], stats_second['prompt_hash']]
+            for key in ('latency', 'prompt_tokens', 'completion_tokens'):
+                record[key] = stats_first[key] + stats_second[key]
+        except Exception as retry_error:
+            print(f"Retry failed for {label}, chunk {chunk['key']}: {retry_error}")
+            metrics.increment('llm_chunks_failed')
+    return record
+
+
+# function to parse every page of a report
+# returns the counts of what dedup dropped and saved, and the number of chunks that failed
+def parse_report(scheduler, company_name, report_year):
+    # file paths for input, parsed output and the checkpoint journal of completed chunks
+    source_path = os.path.join('text', company_name, f"{report_year}.json")
+    destination_path = os.path.join('parsed', company_name, f"{report_year}.json")
+    journal = Journal(destination_path + '.journal')
+
+    # ensure parent directories exist
+    os.makedirs(os.path.join('parsed', company_name), exist_ok=True)
+
+    # reads the input JSON file (source_path), which contains the raw data of the document,
+    # and loads it into the document_data variable
+    with open(source_path, 'rb') as source_file:
+        source_bytes = source_file.read()
+    document_data = json.loads(source_bytes)
+    source_hash = hashlib.sha256(source_bytes).hexdigest()
+
+    # pack short pages together and split long ones so every request fits the token budget
+    # repeated sentences and pages already parsed from the company's earlier reports are dropped first
+    # pages are keyed by their number in the PDF, files processed before page numbers were saved number them in order
+    pages = document_data['pages']
+    numbered_pages = list(zip(document_data.get('page_numbers') or range(1, len(pages) + 1), pages))
+    dedup_stats = {'sentences_dropped': 0, 'pages_suppressed': 0, 'calls_saved': 0, 'failed_chunks': 0}
+    if dedup.DEDUP_MODE == 'on':
+        index_digest = dedup.index_digest(company_name, report_year)
+        unique_pages, signatures, dropped = dedup.deduplicate_pages(company_name, report_year, numbered_pages)
+        chunks = chunk_pages(unique_pages, CHUNK_TOKEN_BUDGET)
+        dedup_stats.update(dropped, calls_saved=len(chunk_pages(numbered_pages, CHUNK_TOKEN_BUDGET)) - len(chunks))
+        metrics.increment('dedup_sentences_dropped', dedup_stats['sentences_dropped'])
+        metrics.increment('dedup_pages_suppressed', dedup_stats['pages_suppressed'])
+        metrics.increment('llm_calls_saved', dedup_stats['calls_saved'])
+        print(f"Dropped {dedup_stats['sentences_dropped']} repeated sentences and {dedup_stats['pages_suppressed']} "
+              f"pages parsed in earlier reports, saving {dedup_stats['calls_saved']} requests")
+    else:
+        chunks = chunk_pages(numbered_pages, CHUNK_TOKEN_BUDGET)
+    print(f"Packed {len(pages)} pages into {len(chunks)} requests")
+
+    # resume from the chunks completed by an interrupted run, as long as the source text and budget are unchanged
+    # the first journal record identifies what the checkpoints belong to, the token counts the chunks were packed
+    # with depend on the tokenizer, and the sentences of every chunk on the pages recorded for the earlier years
+    header = {'source_hash': source_hash, 'chunk_token_budget': CHUNK_TOKEN_BUDGET, 'tokenizer': tokenizer_name(),
+              'dedup': dedup.DEDUP_MODE}
+    if dedup.DEDUP_MODE == 'on':
+        header['dedup_index'] = index_digest
+    completed = {}
+    records = journal.load()
+    if records and records[0] == header:
+        completed = {record['chunk']: record for record in records[1:]}
+    else:
+        journal.remove()
+        journal.append(header)
+    if completed:
+        print(f"Resuming {company_name}, {report_year} from {len(completed)} checkpointed chunks")
+
+    # every remaining chunk is scheduled, the scheduler decides how many run at once
+    # chunks are checkpointed as soon as they succeed, only the chunks that failed are sent again by the next run
+    remaining = [chunk for chunk in chunks if chunk['key'] not in completed]
+    label = f"{company_name}, {report_year}"
+
+    def parse_and_checkpoint(chunk):
+        record = parse_chunk(scheduler, chunk, label)
+        if record['response'] is not None:
+            journal.append(record)
+        return record
+
+    metrics.increment('llm_chunks', len(chunks))
+    metrics.increment('llm_chunks_resumed', len(chunks) - len(remaining))
+    with tqdm.tqdm(total=len(chunks), initial=len(chunks) - len(remaining)) as progress, \
+            metrics.timer('report_seconds', stage='parse'):
+        for record in scheduler.map(parse_and_checkpoint, remaining, progress=progress.update):
+            completed[record['chunk']] = record
+
+    # a report with failed chunks is not finished, its journal is kept and no parsed file is written,
+    # so the report stays pending until a run parses every chunk
+    failed = [chunk['key'] for chunk in chunks if completed[chunk['key']]['response'] is None]
+    dedup_stats['failed_chunks'] = len(failed)
+    if failed:
+        print(f"{len(failed)} chunks of {label} failed, run again to retry them: {', '.join(map(str, failed))}")
+        metrics.increment('llm_reports_incomplete')
+        return dedup_stats
+
+    # save parsed results, one record per chunk in page order, each listing the pages it came from
+    # the output is written atomically, so an existing parsed file is always complete
+    parsed_results = [completed[chunk['key']] for chunk in chunks]
+    atomic_write_json(destination_path, {'parsed_pages': parsed_results})
+    journal.remove()
+
+    # the report's parsed pages can now suppress their duplicates in the company's later reports
+    # only pages sent in an answered chunk are recorded, suppressed pages stay recorded under the year they were parsed
+    if dedup.DEDUP_MODE == 'on':
+        parsed_pages = {page for record in parsed_results if record['response'] is not None for page in record['pages']}
+        dedup.record_pages(company_name, report_year,
+                           {page: signature for page, signature in signatures.items() if page in parsed_pages})
+    return dedup_stats
+
+
+# function to check whether a report has a complete parsed file
+# files cut short by runs from before atomic writes, or holding chunks whose request failed, are not counted as finished
+def is_report_parsed(destination_path):
+    try:
+        with open(destination_path, 'r') as destination_file:
+            parsed_pages = json.load(destination_file).get('parsed_pages')
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    if parsed_pages is None:
+        return False
+    return all(record.get('response') is not None for record in parsed_pages if isinstance(record, dict))
+
+
+# function to list the reports without a complete parsed file, oldest first within every company
+# so pages repeated in later reports are only parsed once
+def pending_reports(company_data):
+    return [
+        (company_name, report_year)
+        for company_name in company_data.keys()
+        for report_year in sorted(company_data[company_name])
+        if not is_report_parsed(os.path.join('parsed', company_name, f"{report_year}.json"))
+    ]
+
+
+def main():
+    # load company data
+    with open("database.json", 'r') as database_file:
+        company_data = json.load(database_file)
+
+    # when every report is already parsed, exit before the scheduler, cache or model are set up
+    reports = pending_reports(company_data)
+    if not reports:
+        print("No reports to parse.")
+        return
+
+    with instrumented_run('llm_parse'):
+        # create directory for parsed results
+        os.makedirs('parsed', exist_ok=True)
+
+        scheduler = LLMScheduler(REQUESTS_PER_SECOND, TOKENS_PER_MINUTE, MAX_CONCURRENCY)
+        calls_saved = 0
+        incomplete = 0
+
+        # process each report
+        for company_name, report_year in reports:
+            print(f"Processing {company_name}, {report_year}")
+            report_stats = parse_report(scheduler, company_name, report_year)
+            calls_saved += report_stats['calls_saved']
+            incomplete += report_stats['failed_chunks'] > 0
+
+        print(f"Deduplication saved {calls_saved} LLM requests")
+        if incomplete:
+            print(f"{incomplete} reports have failed chunks and are left pending")
+
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            print(f"Response cache: {response_cache.stats()}")
+        print(f"LLM backends: {get_router().stats()}")
+
+
+if __name__ == '__main__':
+    main()
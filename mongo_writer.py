@@ -0,0 +1,48 @@
+from pymongo import ASCENDING, ReplaceOne
+
+# compound indexes backing the queries the Greenify API runs on company_metrics
+METRIC_INDEXES = [
+    [("company", ASCENDING), ("year", ASCENDING), ("topic", ASCENDING), ("tags", ASCENDING)],
+    [("tags", ASCENDING), ("company", ASCENDING), ("year", ASCENDING)],
+]
+
+
+# function to build the unique key of an entry, shared by its MongoDB document and its vector
+def entry_key(company_name, report_year, entry):
+    return f"{company_name}-{report_year}-{entry.get('id')}"
+
+
+# function to create the indexes of the metrics collection
+# create_index is a no-op for indexes that already exist, so this is safe to call on every run
+def ensure_indexes(collection):
+    for keys in METRIC_INDEXES:
+        collection.create_index(keys)
+
+
+# function to upsert entries keyed on company-year-id, in unordered bulk writes
+# re-running an upload replaces the documents in place instead of duplicating them
+# returns the number of documents inserted and modified
+def upsert_entries(collection, company_name, report_year, entries, batch_size=1000):
+    inserted = 0
+    modified = 0
+    for start in range(0, len(entries), batch_size):
+        operations = []
+        for entry in entries[start:start + batch_size]:
+            key = entry_key(company_name, report_year, entry)
+            document = dict(entry, _id=key, company=company_name, year=report_year)
+            operations.append(ReplaceOne({"_id": key}, document, upsert=True))
+        result = collection.bulk_write(operations, ordered=False)
+        inserted += result.upserted_count
+        modified += result.modified_count
+    return inserted, modified
+
+
+# function to delete the documents of entries by their company-year-id keys, in batches
+# returns the number of documents deleted
+def delete_entries(collection, keys, batch_size=1000):
+    keys = list(keys)
+    deleted = 0
+    for start in range(0, len(keys), batch_size):
+        result = collection.delete_many({"_id": {"$in": keys[start:start + batch_size]}})
+        deleted += result.deleted_count
+    return deleted
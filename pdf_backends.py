@@ -0,0 +1,208 @@
+import os
+import re
+import mmap
+import ctypes
+from contextlib import contextmanager
+
+# PDF text extraction backends, picked per run with PDF_BACKEND
+# 'pypdf2' (default) is the original pure-Python extraction, 'pypdfium2' uses the PDFium C library and is
+# several times faster, 'pdfminer' uses pdfminer.six's layout analysis
+# the layout-aware backends (pypdfium2 and pdfminer) keep the cells of a table row together on one line,
+# separated by tabs, instead of merging them into the surrounding text
+PDF_BACKEND = os.getenv('PDF_BACKEND', 'pypdf2')
+
+# horizontal gap between two pieces of text on a line, in multiples of the text height, that separates table cells
+CELL_GAP = 2.0
+
+# longest piece of text still counted as a table cell, longer ones are prose, e.g. lines of a two-column layout
+MAX_CELL_LENGTH = 40
+
+
+# function to lay out the text segments of a page as lines
+# segments are (text, left, bottom, right, top) tuples in reading order
+# segments sharing a baseline that are all short enough to be cells form a table row, written once as its cells
+# joined by tabs, every other segment is written as a line of its own
+def layout_text(segments):
+    # group segments whose vertical extents overlap into rows, from the top of the page down
+    rows = []
+    for index in sorted(range(len(segments)), key=lambda index: -segments[index][4]):
+        text, left, bottom, right, top = segments[index]
+        center = (bottom + top) / 2
+        if rows:
+            row = rows[-1]
+            row_bottom, row_top = row['bottom'], row['top']
+            if row_bottom <= center <= row_top:
+                row['members'].append(index)
+                row['bottom'], row['top'] = min(row_bottom, bottom), max(row_top, top)
+                continue
+        rows.append({'members': [index], 'bottom': bottom, 'top': top})
+
+    table_row_of = {}
+    for row in rows:
+        members = sorted(row['members'], key=lambda index: segments[index][1])
+        if len(members) > 1 and all(len(segments[index][0]) <= MAX_CELL_LENGTH for index in members):
+            cells = '\t'.join(segments[index][0] for index in members)
+            for index in members:
+                table_row_of[index] = cells
+
+    lines = []
+    written_rows = set()
+    for index, segment in enumerate(segments):
+        if index not in table_row_of:
+            lines.append(segment[0])
+        elif table_row_of[index] not in written_rows:
+            written_rows.add(table_row_of[index])
+            lines.append(table_row_of[index])
+    return '\n'.join(lines)
+
+
+class PyPDF2Document:
+    """Pages of a PDF read with PyPDF2, which parses each page's content only when its text is requested."""
+
+    def __init__(self, stream):
+        from PyPDF2 import PdfReader
+        self.reader = PdfReader(stream)
+
+    def __len__(self):
+        return len(self.reader.pages)
+
+    def page_text(self, index):
+        return self.reader.pages[index].extract_text()
+
+    def close(self):
+        pass
+
+
+class PdfiumDocument:
+    """Pages of a PDF read with PDFium through pypdfium2, with table rows split into cells on wide gaps."""
+
+    def __init__(self, stream):
+        import pypdfium2
+        # PDFium reads the mapped file in place, through a ctypes view of the mapping
+        self.buffer = (ctypes.c_char * len(stream)).from_buffer(stream)
+        self.document = pypdfium2.PdfDocument(self.buffer)
+
+    def __len__(self):
+        return len(self.document)
+
+    def page_text(self, index):
+        page = self.document[index]
+        text_page = page.get_textpage()
+        try:
+            text = text_page.get_text_range()
+            segments = list(self.iter_segments(text, text_page.get_charbox))
+        finally:
+            text_page.close()
+            page.close()
+        return layout_text(segments)
+
+    @staticmethod
+    def iter_segments(text, get_charbox):
+        # splits every line into segments at gaps between words wider than CELL_GAP times the text height
+        # only the first and last character of every word are measured, the characters line up with the text
+        offset = 0
+        for line in re.split(r'(\r\n|\r|\n)', text):
+            if line in ('\r\n', '\r', '\n') or not line.strip():
+                offset += len(line)
+                continue
+            words = []  # (text, left, bottom, right, top) of every word of the current segment
+            for word in re.finditer(r'\S+', line):
+                first, last = get_charbox(offset + word.start()), get_charbox(offset + word.end() - 1)
+                box = (word.group(0), first[0], min(first[1], last[1]), last[2], max(first[3], last[3]))
+                if words and box[1] - words[-1][3] > CELL_GAP * max(box[4] - box[2], 1.0):
+                    yield PdfiumDocument.merge_words(words)
+                    words = []
+                words.append(box)
+            if words:
+                yield PdfiumDocument.merge_words(words)
+            offset += len(line)
+
+    @staticmethod
+    def merge_words(words):
+        return (' '.join(word[0] for word in words), min(word[1] for word in words), min(word[2] for word in words),
+                max(word[3] for word in words), max(word[4] for word in words))
+
+    def close(self):
+        self.document.close()
+        self.document = self.buffer = None
+
+
+class PdfminerDocument:
+    """Pages of a PDF laid out by pdfminer.six, whose text lines already end at wide gaps such as table cells."""
+
+    def __init__(self, stream):
+        from pdfminer.converter import PDFPageAggregator
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        # only the page objects are read up front, the content of a page is interpreted when its text is requested
+        self.pages = list(PDFPage.create_pages(PDFDocument(PDFParser(stream))))
+        resource_manager = PDFResourceManager(caching=True)
+        self.device = PDFPageAggregator(resource_manager, laparams=LAParams())
+        self.interpreter = PDFPageInterpreter(resource_manager, self.device)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def page_text(self, index):
+        from pdfminer.layout import LTTextBox, LTTextLine
+
+        self.interpreter.process_page(self.pages[index])
+        segments = []
+        for element in self.device.get_result():
+            if not isinstance(element, LTTextBox):
+                continue
+            for line in element:
+                if isinstance(line, LTTextLine) and line.get_text().strip():
+                    segments.append((line.get_text().strip(), line.x0, line.y0, line.x1, line.y1))
+        return layout_text(segments)
+
+    def close(self):
+        pass
+
+
+class EmptyDocument:
+    """Stands in for a zero-length file, e.g. a download cut off before any data, which has no pages to read."""
+
+    def __len__(self):
+        return 0
+
+    def page_text(self, index):
+        raise IndexError(index)
+
+    def close(self):
+        pass
+
+
+BACKENDS = {
+    'pypdf2': PyPDF2Document,
+    'pypdfium2': PdfiumDocument,
+    'pdfminer': PdfminerDocument,
+}
+
+
+# context manager to open a PDF with an extraction backend
+# the file is memory-mapped, so only the parts of it the backend reads for the requested pages are loaded,
+# copy-on-write since PDFium needs a writable buffer, though nothing is ever written back to the file
+@contextmanager
+def open_pdf(pdf_path, backend=PDF_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend: {backend}")
+    with open(pdf_path, 'rb') as pdf_file:
+        # an empty file can't be mapped, and has no pages for any backend
+        if os.fstat(pdf_file.fileno()).st_size == 0:
+            yield EmptyDocument()
+            return
+        mapped = mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        document = None
+        try:
+            document = BACKENDS[backend](mapped)
+            yield document
+        finally:
+            if document is not None:
+                document.close()
+            document = None
+            mapped.close()
@@ -0,0 +1,377 @@
+import os
+import json
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import atomic_write_json
+from instrumentation import metrics, instrumented_run
+
+# record of the inputs and settings every (stage, company, year) node last ran with
+STATE_PATH = os.getenv('PIPELINE_STATE_PATH', 'pipeline_state.json')
+
+# number of reports moving through the pipeline at once
+REPORT_WORKERS = int(os.getenv('PIPELINE_WORKERS', 8))
+
+# number of reports each stage works on at once
+# PDF processing fans out over its own process pool and parsing shares one rate-limited scheduler,
+# so their limits bound how many reports queue on them rather than how much CPU or quota they use
+STAGE_LIMITS = {
+    'process': int(os.getenv('PIPELINE_PROCESS_LIMIT', 1)),
+    'parse': int(os.getenv('PIPELINE_PARSE_LIMIT', 2)),
+    'clean': int(os.getenv('PIPELINE_CLEAN_LIMIT', 4)),
+    'normalize': int(os.getenv('PIPELINE_NORMALIZE_LIMIT', 4)),
+    'upload': 1,  # uploads rewrite the upload manifest and run one at a time anyway
+}
+
+# resources shared by the nodes of a stage, created on first use
+process_pool = None
+llm_scheduler = None
+resources_lock = threading.Lock()
+
+
+# function to process the PDF of a report into its coherent sentences
+def run_process(company_name, report_year):
+    global process_pool
+    import process_pdf
+    report = (company_name, report_year,
+              os.path.join('data', company_name, f"{report_year}.pdf"),
+              os.path.join('text', company_name, f"{report_year}.json"))
+    if process_pdf.NUM_WORKERS <= 1:
+        process_pdf.process_reports_serial([report])
+        return
+    # one pool for the whole run, so the spaCy model is loaded once per worker
+    with resources_lock:
+        if process_pool is None:
+            process_pool = process_pdf.create_pool()
+    process_pdf.process_reports_parallel([report], pool=process_pool)
+    if not os.path.exists(report[3]):
+        raise RuntimeError(f"{report[2]} could not be opened")
+
+
+# function to parse the processed pages of a report with the LLM
+def run_parse(company_name, report_year):
+    global llm_scheduler
+    import llm_parse
+    from llm.scheduler import LLMScheduler
+    # reports parsed at the same time share one scheduler, so together they stay within the provider quota
+    with resources_lock:
+        if llm_scheduler is None:
+            llm_scheduler = LLMScheduler(llm_parse.REQUESTS_PER_SECOND, llm_parse.TOKENS_PER_MINUTE, llm_parse.MAX_CONCURRENCY)
+    result = llm_parse.parse_report(llm_scheduler, company_name, report_year)
+    # a report with failed chunks has no parsed file yet and is left stale, so the next run retries those chunks
+    if result['failed_chunks']:
+        raise RuntimeError(f"{result['failed_chunks']} chunks failed")
+
+
+def run_clean(company_name, report_year):
+    import data_cleaner
+    data_cleaner.clean_report(company_name, report_year)
+
+
+def run_normalize(company_name, report_year):
+    import data_normalizer
+    written, rejected = data_normalizer.normalize_report(company_name, report_year)
+    print(f"Normalized {written} entries for {company_name}, {report_year}, rejected {sum(rejected.values())} {rejected}")
+
+
+def run_upload(company_name, report_year):
+    import data_uploader
+    result = data_uploader.upload_reports([(company_name, report_year)])
+    # a report with failed batches is left stale, so the next run uploads it again
+    if result['failures']:
+        raise RuntimeError(f"{len(result['failures'])} upload batches or deletes failed: {result['failures'][0][2]}")
+
+
+# settings a stage's output depends on besides its input file, changing them re-runs the stage
+def process_settings():
+    import process_pdf
+    # text files from before page numbers were saved are processed again to get them
+    return {'nlp_mode': process_pdf.NLP_MODE, 'pdf_backend': process_pdf.PDF_BACKEND, 'page_numbers': True}
+
+
+def parse_settings():
+    import dedup
+    import llm_parse
+    from llm.backends import get_router
+    from llm.tokens import tokenizer_name
+    return {
+        'model': ','.join(backend.model_name for backend in get_router().backends),
+        'chunk_token_budget': llm_parse.CHUNK_TOKEN_BUDGET,
+        'tokenizer': tokenizer_name(),
+        'prompt': hashlib.sha256(llm_parse.generate_prompt('').encode('utf-8')).hexdigest(),
+        'dedup': {'mode': dedup.DEDUP_MODE, 'simhash_distance': dedup.SIMHASH_DISTANCE,
+                  'page_similarity': dedup.PAGE_SIMILARITY},
+    }
+
+
+# settings of a single report's parse, the pages its company's earlier reports recorded for dedup
+def parse_report_settings(company_name, report_year):
+    import dedup
+    if dedup.DEDUP_MODE != 'on':
+        return {}
+    return {'dedup_index': dedup.index_digest(company_name, report_year)}
+
+
+class Stage:
+    """
+    A step every report goes through: reads one file of the report, writes another (or uploads it),
+    and runs after the stages listed in `after`. A stage run `in_year_order` waits for the same stage of
+    the company's earlier reports, and `report_settings` adds settings that differ between reports.
+    """
+
+    def __init__(self, name, input_path, output_path, run, after=(), settings=None, report_settings=None,
+                 in_year_order=False):
+        self.name = name
+        self.input_path = input_path
+        self.output_path = output_path
+        self.run = run
+        self.after = after
+        self.settings = settings
+        self.report_settings = report_settings
+        self.in_year_order = in_year_order
+
+    def paths(self, company_name, report_year):
+        output_path = self.output_path.format(company=company_name, year=report_year) if self.output_path else None
+        return self.input_path.format(company=company_name, year=report_year), output_path
+
+
+# the stages of a report, in dependency order
+STAGES = [
+    Stage('process', 'data/{company}/{year}.pdf', 'text/{company}/{year}.json', run_process, settings=process_settings),
+    # a report's dedup drops the pages recorded by the company's earlier reports, so those are parsed first
+    Stage('parse', 'text/{company}/{year}.json', 'parsed/{company}/{year}.json', run_parse, after=('process',),
+          settings=parse_settings, report_settings=parse_report_settings, in_year_order=True),
+    Stage('clean', 'parsed/{company}/{year}.json', 'cleaned/{company}/{year}.ndjson', run_clean, after=('parse',)),
+    Stage('normalize', 'cleaned/{company}/{year}.ndjson', 'normalized/{company}/{year}.parquet', run_normalize,
+          after=('clean',)),
+    Stage('upload', 'cleaned/{company}/{year}.ndjson', None, run_upload, after=('clean',)),
+]
+
+
+class PipelineState:
+    """
+    Inputs and settings of the last successful run of every node, and the hashes of the files read, so unchanged
+    files aren't hashed again. Saved after every node, so an interrupted run keeps the work it finished.
+    """
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, 'r') as state_file:
+                state = json.load(state_file)
+            self.nodes = state['nodes']
+            self.files = state['files']
+
+    def file_hash(self, path):
+        # returns the SHA-256 of a file, re-reading it only when its size or modification time changed
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.files.get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source_file:
+            for block in iter(lambda: source_file.read(1 << 20), b''):
+                digest.update(block)
+        with self.lock:
+            self.files[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def get(self, node):
+        with self.lock:
+            return self.nodes.get(node)
+
+    def record(self, node, input_hash, settings):
+        with self.lock:
+            self.nodes[node] = {'input_hash': input_hash, 'settings': settings}
+            atomic_write_json(self.path, {'nodes': self.nodes, 'files': self.files})
+
+
+class PipelineRunner:
+    """
+    Runs every (stage, company, year) node whose input or settings changed since it last succeeded.
+    Reports move through their stages independently, so a report can be parsed while the next one is being
+    processed, and every stage admits at most its limit of reports at once.
+    When a node's output comes out byte-identical, the stages after it see an unchanged input and are skipped.
+    """
+
+    def __init__(self, stages=STAGES, state=None, limits=STAGE_LIMITS, workers=REPORT_WORKERS, force=(), dry_run=False):
+        self.stages = stages
+        self.state = state or PipelineState()
+        self.semaphores = {stage.name: threading.BoundedSemaphore(limits.get(stage.name, 1)) for stage in stages}
+        self.workers = workers
+        self.force = set(force)
+        self.dry_run = dry_run
+        self.settings = {}
+        self.lock = threading.Lock()
+        self.counts = {stage.name: {} for stage in stages}
+        # set once the node of a stage run in year order is done, (stage name, company, year) -> event
+        self.finished = {}
+
+    def stage_settings(self, stage):
+        with self.lock:
+            if stage.name not in self.settings:
+                self.settings[stage.name] = stage.settings() if stage.settings else {}
+            return self.settings[stage.name]
+
+    def node_settings(self, stage, company_name, report_year):
+        settings = self.stage_settings(stage)
+        if stage.report_settings:
+            settings = dict(settings, **stage.report_settings(company_name, report_year))
+        return settings
+
+    def is_stale(self, stage, node, input_path, output_path, input_hash, settings):
+        if stage.name in self.force:
+            return True
+        record = self.state.get(node)
+        if record is None:
+            # outputs made by the individual scripts are adopted when they are newer than their input
+            if output_path and os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+                self.state.record(node, input_hash, settings)
+                return False
+            return True
+        if output_path and not os.path.exists(output_path):
+            return True
+        return record['input_hash'] != input_hash or record['settings'] != settings
+
+    def count(self, stage, status):
+        with self.lock:
+            self.counts[stage.name][status] = self.counts[stage.name].get(status, 0) + 1
+
+    def run_report(self, company_name, report_year):
+        # statuses of the report's nodes, a node only runs when the stages before it are done
+        statuses = {}
+        try:
+            for stage in self.stages:
+                upstream = [statuses.get(name) for name in stage.after]
+                if 'stale' in upstream:
+                    # a dry run can't tell whether the stale stage's output will change, so the stage after it may run too
+                    status = 'stale'
+                    print(f"May run {stage.name}/{company_name}/{report_year}")
+                elif any(status not in (None, 'fresh', 'ran') for status in upstream):
+                    status = 'blocked'
+                else:
+                    self.wait_for_earlier_years(stage, company_name, report_year)
+                    status = self.run_node(stage, company_name, report_year)
+                self.set_finished(stage, company_name, report_year)
+                statuses[stage.name] = status
+                self.count(stage, status)
+                metrics.increment('pipeline_nodes', stage=stage.name, status=status)
+        finally:
+            # reports waiting on this one never wait forever, even if it stopped on an error
+            for stage in self.stages:
+                self.set_finished(stage, company_name, report_year)
+        return statuses
+
+    def wait_for_earlier_years(self, stage, company_name, report_year):
+        if not stage.in_year_order:
+            return
+        for (name, company, year), finished in self.finished.items():
+            if name == stage.name and company == company_name and str(year) < str(report_year):
+                finished.wait()
+
+    def set_finished(self, stage, company_name, report_year):
+        finished = self.finished.get((stage.name, company_name, report_year))
+        if finished is not None:
+            finished.set()
+
+    def run_node(self, stage, company_name, report_year):
+        node = f"{stage.name}/{company_name}/{report_year}"
+        input_path, output_path = stage.paths(company_name, report_year)
+        if not os.path.exists(input_path):
+            return 'missing input'
+        input_hash = self.state.file_hash(input_path)
+        settings = self.node_settings(stage, company_name, report_year)
+        if not self.is_stale(stage, node, input_path, output_path, input_hash, settings):
+            return 'fresh'
+        if self.dry_run:
+            print(f"Would run {node}")
+            return 'stale'
+
+        with self.semaphores[stage.name]:
+            print(f"Running {node}")
+            try:
+                with metrics.timer('node_seconds', stage=stage.name):
+                    stage.run(company_name, report_year)
+            except Exception as error:
+                print(f"Failed {node}: {error}")
+                return 'failed'
+        self.state.record(node, input_hash, settings)
+        return 'ran'
+
+    def run(self, reports):
+        # reports is a list of (company_name, report_year) tuples
+        # they start oldest first, so a report waiting on a company's earlier year never holds up that year's worker
+        reports = sorted(reports, key=lambda report: str(report[1]))
+        self.finished = {
+            (stage.name, company_name, report_year): threading.Event()
+            for stage in self.stages if stage.in_year_order
+            for company_name, report_year in reports
+        }
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(lambda report: self.run_report(*report), reports))
+        return self.counts
+
+
+# function to download new reports and add them to database.json
+def download_reports():
+    import database_gen
+    database_gen.process_companies(database_gen.companies)
+    atomic_write_json(database_gen.data_file, database_gen.data, indent=4)
+    database_gen.report_store.save()
+    print(f"Report store: {database_gen.report_store.stats()}")
+
+
+def main():
+    with instrumented_run('pipeline'):
+        parser = argparse.ArgumentParser(description="Run every stage that is out of date for the reports in database.json.")
+        parser.add_argument('--download', action='store_true', help="download new reports before running the stages")
+        parser.add_argument('--stages', default=','.join(stage.name for stage in STAGES),
+                            help="comma-separated stages to run (default: all)")
+        parser.add_argument('--company', action='append', help="only run the reports of this company (repeatable)")
+        parser.add_argument('--force', action='append', default=[], help="re-run every node of this stage (repeatable)")
+        parser.add_argument('--dry-run', action='store_true', help="list the nodes that would run without running them")
+        args = parser.parse_args()
+
+        selected = args.stages.split(',')
+        unknown = set(selected + args.force) - {stage.name for stage in STAGES}
+        if unknown:
+            parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+        if args.download and not args.dry_run:
+            download_reports()
+
+        # load company data
+        with open("database.json", 'r') as database_file:
+            company_data = json.load(database_file)
+        # the runner parses a company's reports oldest first, so their pages are there for the dedup of the later ones
+        reports = [
+            (company_name, report_year)
+            for company_name, report_years in company_data.items()
+            if not args.company or company_name in args.company
+            for report_year in sorted(report_years)
+        ]
+
+        runner = PipelineRunner([stage for stage in STAGES if stage.name in selected], force=args.force, dry_run=args.dry_run)
+        try:
+            counts = runner.run(reports)
+        finally:
+            if process_pool is not None:
+                process_pool.shutdown()
+
+        # entries of reports dropped from the database are deleted once the whole database has been seen
+        if 'upload' in selected and not args.company and not args.dry_run:
+            import data_uploader
+            print(f"Deleted {data_uploader.remove_dropped_reports(company_data)} entries of removed reports")
+
+        for stage_name, stage_counts in counts.items():
+            print(f"{stage_name:<10} {stage_counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,88 @@
 import os
 import json
 import re
-from PyPDF2 import PdfReader
-import spacy
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-# load the small English SpaCy model (en_core_web_sm) to tokenize and parse text
-nlp = spacy.load("en_core_web_sm")
+from storage import atomic_write_json
+from pdf_backends import PDF_BACKEND, open_pdf
+from instrumentation import metrics, instrumented_run
 
-# create a directory to store extracted text data if it doesn't exist
-os.makedirs('text', exist_ok=True)
+# number of worker processes used to extract reports, 1 keeps everything in a single process
+NUM_WORKERS = int(os.getenv('PDF_WORKERS', os.cpu_count() or 1))
 
-# function to extract text from all pages of a PDF document
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from all pages of a PDF file."""
-    pdf_reader = PdfReader(pdf_path)
-    for page in pdf_reader.pages:
-        # return the text of each page one by one without storing the full content in memory at once
-        yield page.extract_text()
+# large reports are split into page ranges of this size so several workers can share one report
+PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', 25))
+
+# SpaCy pipeline mode used by the coherence filter
+# 'accurate' keeps the dependency parser, 'fast' replaces it with a rule-based
+# sentencizer and part-of-speech heuristics
+NLP_MODE = os.getenv('NLP_MODE', 'accurate')
+
+# number of pages SpaCy processes together in nlp.pipe
+NLP_BATCH_SIZE = int(os.getenv('NLP_BATCH_SIZE', 16))
+
+# pipeline components the coherence filter never reads
+UNUSED_COMPONENTS = ["ner", "lemmatizer"]
+
+# part-of-speech tags that can act as the subject of a sentence in fast mode
+SUBJECT_POS = {"NOUN", "PROPN", "PRON"}
+
+# the small English SpaCy models (en_core_web_sm) used to tokenize and parse text, by mode
+# loaded lazily so every worker process loads them exactly once, and runs without pending reports never import SpaCy
+nlp_models = {}
+
+
+# function to load the SpaCy model for a mode once per process
+def load_nlp(mode=NLP_MODE):
+    if mode not in nlp_models:
+        import spacy
+        if mode == 'accurate':
+            nlp_models[mode] = spacy.load("en_core_web_sm", exclude=UNUSED_COMPONENTS)
+        elif mode == 'fast':
+            model = spacy.load("en_core_web_sm", exclude=UNUSED_COMPONENTS + ["parser"])
+            model.add_pipe("sentencizer")
+            nlp_models[mode] = model
+        else:
+            raise ValueError(f"Unknown NLP mode: {mode}")
+    return nlp_models[mode]
+
+
+# function to extract text from the pages of a PDF document
+def extract_text_from_pdf(pdf_path, start=0, stop=None, backend=PDF_BACKEND):
+    """Extracts text from the pages of a PDF file, optionally limited to the range [start, stop)."""
+    with open_pdf(pdf_path, backend) as document:
+        stop = len(document) if stop is None else min(stop, len(document))
+        for page_index in range(start, stop):
+            # return the text of each page one by one without storing the full content in memory at once
+            # a page that can't be extracted is counted and kept empty instead of failing the whole report
+            try:
+                yield document.page_text(page_index)
+            except Exception as error:
+                print(f"Failed to extract page {page_index} of {pdf_path}: {error}")
+                metrics.increment('pdf_pages_failed')
+                yield ''
+
+
+# function to count the pages of a PDF document
+def count_pdf_pages(pdf_path, backend=PDF_BACKEND):
+    with open_pdf(pdf_path, backend) as document:
+        return len(document)
+
+
+# function to split the text of a page into its prose and its table rows
+# the layout-aware backends write the cells of a table row on one line separated by tabs,
+# rows are kept as units of their own with their cells separated by " | ", and rows without a number are dropped
+def split_table_rows(page_text):
+    prose_lines = []
+    table_rows = []
+    for line in page_text.split('\n'):
+        if '\t' not in line:
+            prose_lines.append(line)
+        elif any(character.isdigit() for character in line):
+            table_rows.append(' | '.join(cell.strip() for cell in line.split('\t') if cell.strip()))
+    return '\n'.join(prose_lines), table_rows
 
-# load the database of company data
-with open("database.json", 'r') as file:
-    company_data = json.load(file)
 
 # function to check if a sentence is coherent
 def is_sentence_coherent(sentence):
@@ -32,46 +94,201 @@ def is_sentence_coherent(sentence):
     has_verb = any(token.pos_ == "VERB" for token in sentence)
     return has_subject and has_verb
 
-# iterate through each company and its associated report data
-for company_name, reports in company_data.items():
-    for report_year in reports:
+
+# function to check if a sentence is coherent without a dependency parse
+def is_sentence_coherent_fast(sentence):
+    """
+    Approximates is_sentence_coherent from part-of-speech tags only, by checking
+    for a verb that is preceded by a noun or pronoun that can act as its subject.
+    """
+    for token in sentence:
+        if token.pos_ == "VERB":
+            return any(previous.pos_ in SUBJECT_POS for previous in sentence[:token.i - sentence.start])
+    return False
+
+
+# function to filter a stream of page texts down to their coherent sentences
+# pages are fed through nlp.pipe in batches, and one list of sentences is yielded per page,
+# followed by the page's table rows, which have no sentence structure to check
+def filter_coherent_pages(page_texts, mode=NLP_MODE, batch_size=NLP_BATCH_SIZE):
+    model = load_nlp(mode)
+    is_coherent = is_sentence_coherent_fast if mode == 'fast' else is_sentence_coherent
+
+    def split_pages():
+        for page_text in page_texts:
+            prose, table_rows = split_table_rows(page_text)
+            # replace newlines with spaces for better sentence parsing
+            yield re.sub(r'\n+', ' ', prose), table_rows
+
+    for doc, table_rows in model.pipe(split_pages(), batch_size=batch_size, as_tuples=True):
+        metrics.increment('pdf_table_rows', len(table_rows))
+        # filter coherent sentences
+        yield [str(sentence) for sentence in doc.sents if is_coherent(sentence)] + table_rows
+
+
+# function to extract the coherent sentences of a range of pages
+# returns one list of sentences per page, in page order (empty for pages without coherent sentences)
+# the time spent extracting text is measured apart from the SpaCy time spent on it
+def process_page_range(pdf_path, start=0, stop=None, mode=NLP_MODE, backend=PDF_BACKEND):
+    extract_seconds = 0.0
+
+    def timed_page_texts():
+        nonlocal extract_seconds
+        page_texts = extract_text_from_pdf(pdf_path, start, stop, backend)
+        while True:
+            started = time.perf_counter()
+            page_text = next(page_texts, None)
+            extract_seconds += time.perf_counter() - started
+            if page_text is None:
+                return
+            yield page_text
+
+    started = time.perf_counter()
+    pages = list(filter_coherent_pages(timed_page_texts(), mode))
+    metrics.observe('pdf_extract_seconds', extract_seconds, backend=backend)
+    metrics.observe('nlp_seconds', time.perf_counter() - started - extract_seconds, mode=mode)
+    metrics.increment('pdf_pages', len(pages))
+    # pages without a single coherent sentence are dropped from the processed report
+    metrics.increment('pdf_pages_dropped', sum(1 for page in pages if not page))
+    return pages
+
+
+# function run by the worker processes: processes a range of pages and ships the worker's metrics back with it
+def process_page_range_with_metrics(pdf_path, start=0, stop=None, mode=NLP_MODE):
+    return process_page_range(pdf_path, start, stop, mode), metrics.drain()
+
+
+# function to save the processed pages of a report
+def save_processed_pages(json_file_path, pages):
+    # dictionary structure to store extracted text, organized by pages
+    # only pages with coherent sentences are kept, along with their page numbers in the PDF (starting at 1)
+    processed_data = {
+        'pages': [page for page in pages if page],
+        'page_numbers': [page_number for page_number, page in enumerate(pages, start=1) if page],
+    }
+
+    # the file is written atomically so an interrupted run never leaves a half-written report behind
+    atomic_write_json(json_file_path, processed_data)
+
+
+# function to list the reports that still need to be processed
+# returns (company_name, report_year, pdf_path, json_file_path) tuples
+def pending_reports(company_data):
+    reports = []
+    for company_name, report_years in company_data.items():
+        for report_year in report_years:
+            # path to the PDF file and its corresponding JSON file
+            pdf_path = os.path.join('data', company_name, f"{report_year}.pdf")
+            json_file_path = os.path.join('text', company_name, f"{report_year}.json")
+
+            # skip if this report has already been processed
+            if os.path.exists(json_file_path):
+                print(f"Report {report_year} for {company_name} already processed. Skipping.")
+                continue
+            reports.append((company_name, report_year, pdf_path, json_file_path))
+    return reports
+
+
+# function to process reports one page at a time in the current process
+def process_reports_serial(reports):
+    for company_name, report_year, pdf_path, json_file_path in reports:
         print(f"Processing report for {company_name} ({report_year})")
+        os.makedirs(os.path.dirname(json_file_path), exist_ok=True)
+        with metrics.timer('report_seconds', stage='process'):
+            save_processed_pages(json_file_path, process_page_range(pdf_path))
+        print(f"Processed report for {company_name} ({report_year}) saved.")
 
-        # path to the PDF file and its corresponding JSON file 
-        pdf_path = os.path.join('data', company_name, f"{report_year}.pdf")
-        company_text_dir = os.path.join('text', company_name)
-        json_file_path = os.path.join(company_text_dir, f"{report_year}.json")
 
-        # skip if this report has already been processed
-        if os.path.exists(json_file_path):
-            print(f"Report {report_year} for {company_name} already processed. Skipping.")
+# function run once in every worker process as it starts
+# forked workers inherit the parent's metrics, which are dropped so they aren't shipped back and counted twice
+def init_worker(mode=NLP_MODE):
+    metrics.reset()
+    load_nlp(mode)
+
+
+# function to create the pool of worker processes, each loading the spaCy model once
+def create_pool(num_workers=NUM_WORKERS):
+    return ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker, initargs=(NLP_MODE,))
+
+
+# function to process reports across a pool of worker processes
+# every report is split into page ranges, and a report is saved as soon as all of its ranges are done
+# a pool can be passed in to keep the loaded models across calls
+def process_reports_parallel(reports, num_workers=NUM_WORKERS, pages_per_task=PAGES_PER_TASK, pool=None):
+    if pool is None:
+        with create_pool(num_workers) as pool:
+            return process_reports_parallel(reports, num_workers, pages_per_task, pool)
+
+    futures = {}
+    report_pages = {}
+    for report in reports:
+        company_name, report_year, pdf_path, json_file_path = report
+        # a report that can't be opened is left unprocessed instead of stopping the others
+        try:
+            page_count = count_pdf_pages(pdf_path)
+        except Exception as error:
+            print(f"Failed to open {pdf_path}: {error}")
+            metrics.increment('pdf_reports_failed')
             continue
+        ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+        report_pages[report] = [None] * len(ranges)
+        for range_index, (start, stop) in enumerate(ranges):
+            future = pool.submit(process_page_range_with_metrics, pdf_path, start, stop)
+            futures[future] = (report, range_index)
 
-        # ensure the directory for storing text data exists
-        os.makedirs(company_text_dir, exist_ok=True)
+    for future in as_completed(futures):
+        report, range_index = futures[future]
+        company_name, report_year, pdf_path, json_file_path = report
+        # a report with a failed page range is left unprocessed and its other ranges are discarded,
+        # the rest of the reports are still saved
+        try:
+            page_range, worker_metrics = future.result()
+        except Exception as error:
+            if report in report_pages:
+                print(f"Failed to process {pdf_path}: {error}")
+                metrics.increment('pdf_reports_failed')
+                del report_pages[report]
+            continue
+        metrics.merge(worker_metrics)
+        if report not in report_pages:
+            continue
+        results = report_pages[report]
+        results[range_index] = page_range
 
-        # dictionary structure to store extracted text, organized by pages
-        processed_data = {'pages': []}
+        # save the report once every one of its page ranges has been processed
+        if all(result is not None for result in results):
+            os.makedirs(os.path.dirname(json_file_path), exist_ok=True)
+            save_processed_pages(json_file_path, [page for result in results for page in result])
+            del report_pages[report]
+            print(f"Processed report for {company_name} ({report_year}) saved.")
 
-        # extract and process text from each page of the PDF
-        for page_text in extract_text_from_pdf(pdf_path):
-            # replace newlines with spaces for better sentence parsing
-            cleaned_text = re.sub(r'\n+', ' ', page_text)
+    # reports without any pages never get a range, save them empty like the serial path does
+    for company_name, report_year, pdf_path, json_file_path in report_pages:
+        os.makedirs(os.path.dirname(json_file_path), exist_ok=True)
+        save_processed_pages(json_file_path, [])
 
-            # process the cleaned text using SpaCy's NLP model
-            doc = nlp(cleaned_text)
 
-            # filter coherent sentences
-            coherent_sentences = [
-                str(sentence) for sentence in doc.sents if is_sentence_coherent(sentence)
-            ]
+def main():
+    # load the database of company data
+    with open("database.json", 'r') as file:
+        company_data = json.load(file)
 
-            # add coherent sentences to the page data
-            if coherent_sentences:
-                processed_data['pages'].append(coherent_sentences)
+    # iterate through each company and its associated report data
+    # when every report is already processed, exit before SpaCy or the worker pool are loaded
+    reports = pending_reports(company_data)
+    if not reports:
+        print("No reports to process.")
+        return
 
-        # save the processed text data to a JSON file
-        with open(json_file_path, 'w') as json_file:
-            json.dump(processed_data, json_file) # json.dump() function takes a Python object and converts it into a JSON string
+    with instrumented_run('process_pdf'):
+        # create a directory to store extracted text data if it doesn't exist
+        os.makedirs('text', exist_ok=True)
 
-        print(f"Processed report for {company_name} ({report_year}) saved.")
+        if NUM_WORKERS > 1:
+            process_reports_parallel(reports)
+        else:
+            process_reports_serial(reports)
+
+
+if __name__ == '__main__':
+    main()
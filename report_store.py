@@ -0,0 +1,117 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from storage import atomic_write_json
+
+
+class ReportStore:
+    """
+    Content-addressed store for downloaded report PDFs.
+    Every PDF is kept once under its SHA-256 in an objects directory and linked to data/<company>/<year>.pdf,
+    and the ETag and Last-Modified validators of every report URL are recorded so refreshes can use conditional GETs.
+    """
+
+    def __init__(self, root='data'):
+        self.root = root
+        self.objects_dir = os.path.join(root, '.objects')
+        self.index_path = os.path.join(root, '.http_cache.json')
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as index_file:
+                self.entries = json.load(index_file)
+        self.downloaded = 0
+        self.not_modified = 0
+        self.deduplicated = 0
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], f"{sha256}.pdf")
+
+    def cached_object(self, url):
+        # returns the hash of the stored content for a URL, None if it has not been stored
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry and os.path.exists(self.object_path(entry['sha256'])):
+            return entry['sha256']
+        return None
+
+    def conditional_headers(self, url):
+        # returns the headers that turn a GET for a stored URL into a conditional GET
+        if not self.cached_object(url):
+            return {}
+        with self.lock:
+            entry = self.entries[url]
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def mark_not_modified(self, url):
+        # records a 304 response and returns the hash of the stored content
+        with self.lock:
+            self.not_modified += 1
+        return self.cached_object(url)
+
+    def store(self, url, chunks, headers):
+        # writes the streamed chunks to the store, hashing them on the way, and returns their hash
+        # content that is already stored (e.g. the same PDF listed under several years) is kept only once
+        os.makedirs(self.objects_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.objects_dir, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temp_file:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            sha256 = digest.hexdigest()
+            object_path = self.object_path(sha256)
+            with self.lock:
+                self.downloaded += 1
+                if os.path.exists(object_path):
+                    self.deduplicated += 1
+                    os.remove(temp_path)
+                else:
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    os.replace(temp_path, object_path)
+                self.entries[url] = {
+                    'sha256': sha256,
+                    'etag': headers.get('ETag'),
+                    'last_modified': headers.get('Last-Modified'),
+                }
+            return sha256
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def link(self, sha256, destination):
+        # makes destination point at the stored content, as a hard link where the filesystem allows it
+        object_path = self.object_path(sha256)
+        if os.path.exists(destination) and os.path.samefile(destination, object_path):
+            return
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temp_path = f"{destination}.{threading.get_ident()}.tmp"
+        try:
+            os.link(object_path, temp_path)
+        except OSError:
+            shutil.copyfile(object_path, temp_path)
+        os.replace(temp_path, destination)
+
+    def save(self):
+        with self.lock:
+            atomic_write_json(self.index_path, self.entries, indent=4)
+
+    def stats(self):
+        return {
+            'downloaded': self.downloaded,
+            'not_modified': self.not_modified,
+            'deduplicated': self.deduplicated,
+        }
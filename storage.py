@@ -0,0 +1,82 @@
+import os
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+# context manager to write a file atomically
+# the content goes to a temporary file in the same directory, which replaces the destination
+# only once it has been completely written, so readers never see a partial file
+@contextmanager
+def atomic_open(path, mode='w'):
+    directory = os.path.dirname(path) or '.'
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, mode) as temp_file:
+            yield temp_file
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# function to atomically save a Python object as a JSON file
+def atomic_write_json(path, data, **kwargs):
+    with atomic_open(path, 'w') as json_file:
+        json.dump(data, json_file, **kwargs)
+
+
+# function to stream the records of an NDJSON file, one JSON value per line
+def iter_ndjson(path):
+    with open(path, 'r') as ndjson_file:
+        for line in ndjson_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Journal:
+    """
+    Append-only JSON lines file, synced to disk after every record, used to checkpoint
+    long-running work so an interrupted run can resume from the last completed record.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        # returns the records written so far
+        # a line cut short by a crash is dropped and truncated away so new records start on a clean line
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        valid_length = 0
+        with open(self.path, 'rb') as journal_file:
+            for line in journal_file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                valid_length += len(line)
+        if valid_length != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(valid_length)
+        return records
+
+    def append(self, record):
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as journal_file:
+                journal_file.write(line)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
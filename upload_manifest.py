@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+
+from storage import atomic_write_json
+from mongo_writer import entry_key
+
+
+# function to hash a file's contents, read in blocks so large files aren't loaded at once
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# function to hash a cleaned entry, independent of the order of its keys
+def entry_hash(entry):
+    return hashlib.sha256(json.dumps(entry, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class UploadManifest:
+    """
+    Record of what the last uploads pushed: the hash of every cleaned file and of every entry in it, keyed on
+    company-year-id. Comparing a report against it gives the entries to upsert and the keys to delete.
+    The manifest belongs to one upload target (embedding model and vector store); when the target changes,
+    everything is uploaded again.
+    """
+
+    def __init__(self, path, target):
+        self.path = path
+        self.target = target
+        self.reports = {}
+        if os.path.exists(path):
+            with open(path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('target') == target:
+                self.reports = manifest['reports']
+
+    @staticmethod
+    def report_key(company_name, report_year):
+        return f"{company_name}/{report_year}"
+
+    def uploaded_reports(self):
+        # returns the (company, year) of every report in the manifest
+        return [tuple(key.rsplit('/', 1)) for key in self.reports]
+
+    def is_unchanged(self, company_name, report_year, source_hash):
+        report = self.reports.get(self.report_key(company_name, report_year))
+        return report is not None and report['file_hash'] == source_hash
+
+    def diff(self, company_name, report_year, entries):
+        # returns the new or changed entries, the keys of the removed entries, and the hash of every current entry
+        uploaded = self.reports.get(self.report_key(company_name, report_year), {}).get('entries', {})
+        hashes = {}
+        changed = []
+        for entry in entries:
+            key = entry_key(company_name, report_year, entry)
+            hashes[key] = entry_hash(entry)
+            if uploaded.get(key) != hashes[key]:
+                changed.append(entry)
+        removed = [key for key in uploaded if key not in hashes]
+        return changed, removed, hashes
+
+    def record(self, company_name, report_year, source_hash, entry_hashes):
+        self.reports[self.report_key(company_name, report_year)] = {'file_hash': source_hash, 'entries': entry_hashes}
+
+    def uploaded_keys(self, company_name, report_year):
+        # returns the keys of the entries a report had uploaded
+        return list(self.reports.get(self.report_key(company_name, report_year), {}).get('entries', {}))
+
+    def forget(self, company_name, report_year):
+        # removes a report and returns the keys of the entries it had uploaded
+        report = self.reports.pop(self.report_key(company_name, report_year), {})
+        return list(report.get('entries', {}))
+
+    def save(self):
+        atomic_write_json(self.path, {'target': self.target, 'reports': self.reports})
@@ -0,0 +1,170 @@
+import time
+import queue
+import threading
+
+from mongo_writer import entry_key, upsert_entries
+from instrumentation import metrics
+
+# marker put on a stage's queue to stop one of its workers
+STOP = object()
+
+
+# function to build the Pinecone metadata of an entry
+# Pinecone only accepts lists of strings, so the source page indices are stored as strings
+def vector_metadata(entry):
+    metadata = dict(entry)
+    if 'pages' in metadata:
+        metadata['pages'] = [str(page) for page in metadata['pages']]
+    return metadata
+
+
+class PipelineStage:
+    """
+    A pool of worker threads consuming batches from a bounded queue.
+    Each batch is passed to the handler, retried with exponential backoff, and the handler's result is put
+    on the queues of the downstream stages. A full queue blocks the stage feeding it, so a slow backend
+    holds back the stages before it instead of letting batches pile up in memory.
+    """
+
+    def __init__(self, name, handler, workers=1, queue_size=8, retries=3, retry_backoff=1.0, outputs=()):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.outputs = list(outputs)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.retried = 0
+        self.failures = []
+        self.busy_time = 0.0
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, batch):
+        self.queue.put(batch)
+
+    def close(self):
+        # waits for the queued batches to be processed, then stops the workers
+        for _ in self.threads:
+            self.queue.put(STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            batch = self.queue.get()
+            if batch is STOP:
+                return
+            start = time.perf_counter()
+            result = self._handle(batch)
+            with self.lock:
+                self.busy_time += time.perf_counter() - start
+            if result is None:
+                continue
+            for output in self.outputs:
+                output.put(result)
+
+    def _handle(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.timer('upload_batch_seconds', stage=self.name):
+                    result = self.handler(batch)
+            except Exception as error:
+                if attempt == self.retries:
+                    # a failed batch is recorded and dropped, so the rest of the pipeline keeps flowing
+                    print(f"{self.name} failed for {batch['company']}, {batch['year']}: {error}")
+                    with self.lock:
+                        self.failures.append((batch['company'], batch['year'], str(error)))
+                    metrics.increment('upload_failed_batches', stage=self.name)
+                    return None
+                with self.lock:
+                    self.retried += 1
+                metrics.increment('upload_retries', stage=self.name)
+                time.sleep(self.retry_backoff * 2 ** attempt)
+            else:
+                with self.lock:
+                    self.processed += len(batch['entries'])
+                metrics.increment('uploaded_entries', len(batch['entries']), stage=self.name)
+                return result
+
+    def stats(self):
+        return {
+            'entries': self.processed,
+            'retries': self.retried,
+            'failures': len(self.failures),
+            'busy_seconds': round(self.busy_time, 3),
+        }
+
+
+class UploadPipeline:
+    """
+    Uploads cleaned entries through three concurrent stages:
+    embedding, vector store upserts and MongoDB bulk writes, each with its own worker count.
+    MongoDB writes don't need the embeddings, so they are fed straight from the reader.
+    """
+
+    def __init__(self, embedder, vector_index, collection, upload_batch_size=100, mongo_batch_size=1000,
+                 embed_workers=2, vector_workers=4, mongo_workers=2, queue_size=8, progress=None):
+        self.embedder = embedder
+        self.vector_index = vector_index
+        self.collection = collection
+        self.upload_batch_size = upload_batch_size
+        self.mongo_batch_size = mongo_batch_size
+        self.progress = progress
+
+        self.vector_stage = PipelineStage('vectors', self._upsert_vectors, vector_workers, queue_size)
+        self.embed_stage = PipelineStage('embed', self._embed, embed_workers, queue_size, outputs=[self.vector_stage])
+        self.mongo_stage = PipelineStage('mongo', self._write_documents, mongo_workers, queue_size)
+        self.stages = [self.embed_stage, self.vector_stage, self.mongo_stage]
+
+    def _embed(self, batch):
+        vectors = self.embedder.embed([entry.get("description", "") for entry in batch['entries']])  # Ensure description exists
+        return dict(batch, vectors=vectors)
+
+    def _upsert_vectors(self, batch):
+        self.vector_index.upsert(vectors=[
+            {
+                "id": entry_key(batch['company'], batch['year'], entry),
+                "values": vector,
+                "metadata": vector_metadata(entry),
+            }
+            for entry, vector in zip(batch['entries'], batch['vectors'])
+        ])
+        if self.progress:
+            self.progress(len(batch['entries']))
+        return batch
+
+    def _write_documents(self, batch):
+        upsert_entries(self.collection, batch['company'], batch['year'], batch['entries'], self.mongo_batch_size)
+        return batch
+
+    def run(self, reports):
+        # reports is an iterable of (company_name, report_year, entries) tuples
+        for stage in self.stages:
+            stage.start()
+        try:
+            for company_name, report_year, entries in reports:
+                for entry in entries:
+                    entry['year'] = report_year
+                    entry['company'] = company_name
+                for start in range(0, len(entries), self.upload_batch_size):
+                    self.embed_stage.put({'company': company_name, 'year': report_year,
+                                          'entries': entries[start:start + self.upload_batch_size]})
+                for start in range(0, len(entries), self.mongo_batch_size):
+                    self.mongo_stage.put({'company': company_name, 'year': report_year,
+                                          'entries': entries[start:start + self.mongo_batch_size]})
+        finally:
+            # stages are closed in order, so each one drains before the stages it feeds are stopped
+            for stage in self.stages:
+                stage.close()
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def failures(self):
+        return [failure for stage in self.stages for failure in stage.failures]
@@ -0,0 +1,326 @@
+import os
+import json
+import threading
+import numpy as np
+
+from storage import atomic_write_json
+
+# hnswlib is optional, without it the local store searches by brute force
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# settings of the Pinecone index
+PINECONE_INDEX_NAME = "company-key-data"
+VECTOR_DIMENSION = 1536
+
+# most IDs Pinecone accepts in a single delete request
+PINECONE_DELETE_BATCH_SIZE = 1000
+
+# metadata fields with an inverted index in the local store, so filters on them don't scan every entry
+INDEXED_FIELDS = ("company", "year", "topic")
+
+
+class PineconeVectorStore:
+    """Vector store backed by the serverless Pinecone index."""
+
+    def __init__(self, api_key, region, index_name=PINECONE_INDEX_NAME, dimension=VECTOR_DIMENSION):
+        from pinecone import Pinecone, ServerlessSpec
+
+        # create an instance of the Pinecone class
+        pc = Pinecone(api_key=api_key)
+
+        # ensure Pinecone index exists
+        if index_name not in [index.name for index in pc.list_indexes()]:
+            pc.create_index(
+                name=index_name,
+                dimension=dimension,
+                metric='cosine',
+                spec=ServerlessSpec(
+                    cloud='aws',
+                    region=region
+                )
+            )
+        self.index = pc.Index(index_name)
+
+    def upsert(self, vectors):
+        return self.index.upsert(vectors=vectors)
+
+    def query(self, vector, top_k=10, filter=None):
+        response = self.index.query(vector=vector, top_k=top_k, filter=filter, include_metadata=True)
+        return {'matches': [
+            {'id': match['id'], 'score': match['score'], 'metadata': match.get('metadata', {})}
+            for match in response['matches']
+        ]}
+
+    def delete(self, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), PINECONE_DELETE_BATCH_SIZE):
+            self.index.delete(ids=ids[start:start + PINECONE_DELETE_BATCH_SIZE])
+
+    def save(self):
+        pass
+
+
+# function to check whether metadata matches a Pinecone-style filter
+# supports exact values and the $eq, $ne, $in and $nin operators
+def matches_filter(metadata, filter):
+    for field, condition in filter.items():
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for operator, operand in condition.items():
+            if operator == '$eq' and value != operand:
+                return False
+            if operator == '$ne' and value == operand:
+                return False
+            if operator == '$in' and value not in operand:
+                return False
+            if operator == '$nin' and value in operand:
+                return False
+    return True
+
+
+class LocalVectorStore:
+    """
+    Vector store kept on local disk, with the same upsert/query/delete interface as the Pinecone store.
+    Vectors are normalized for cosine similarity and stored in a memory-mapped float32 matrix, or an int8 matrix
+    with one scale per row when quantized. Queries go through an HNSW index when hnswlib is available and
+    fall back to brute-force search otherwise. Metadata can be filtered on like in Pinecone.
+    """
+
+    def __init__(self, path, dimension=VECTOR_DIMENSION, quantize=False, use_hnsw=True,
+                 hnsw_m=16, hnsw_ef_construction=200, hnsw_ef_search=100):
+        self.path = path
+        self.dimension = dimension
+        self.quantize = quantize
+        self.use_hnsw = use_hnsw and hnswlib is not None
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        # row bookkeeping: ids and metadata by row, and the row of every live id
+        self.state_path = os.path.join(path, 'state.json')
+        state = {'ids': [], 'metadata': [], 'capacity': 0}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as state_file:
+                state = json.load(state_file)
+        self.ids = state['ids']
+        self.metadata = state['metadata']
+        self.capacity = state['capacity']
+        self.rows = {vector_id: row for row, vector_id in enumerate(self.ids) if vector_id is not None}
+
+        # inverted index of the indexed metadata fields: field -> value -> set of rows
+        self.inverted = {field: {} for field in INDEXED_FIELDS}
+        for row, vector_id in enumerate(self.ids):
+            if vector_id is not None:
+                self._index_metadata(row)
+
+        self.matrix = None
+        self.scales = None
+        self._open_matrix(self.capacity)
+
+        self.hnsw = None
+        if self.use_hnsw:
+            self._open_hnsw()
+
+    def _matrix_paths(self):
+        if self.quantize:
+            return os.path.join(self.path, 'vectors.i8'), os.path.join(self.path, 'scales.f32')
+        return os.path.join(self.path, 'vectors.f32'), None
+
+    def _open_matrix(self, capacity):
+        # maps the vector matrix (and the per-row scales of a quantized store) from disk
+        if capacity == 0:
+            self.matrix = np.zeros((0, self.dimension), dtype=np.int8 if self.quantize else np.float32)
+            self.scales = np.zeros(0, dtype=np.float32)
+            return
+        matrix_path, scales_path = self._matrix_paths()
+        dtype = np.int8 if self.quantize else np.float32
+        mode = 'r+' if os.path.exists(matrix_path) else 'w+'
+        self.matrix = np.memmap(matrix_path, dtype=dtype, mode=mode, shape=(capacity, self.dimension))
+        if scales_path:
+            mode = 'r+' if os.path.exists(scales_path) else 'w+'
+            self.scales = np.memmap(scales_path, dtype=np.float32, mode=mode, shape=(capacity,))
+
+    def _grow(self, needed):
+        # doubles the capacity of the memory-mapped files until the needed rows fit
+        capacity = max(1024, self.capacity)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        matrix_path, scales_path = self._matrix_paths()
+        if self.capacity:
+            self.matrix.flush()
+            del self.matrix
+            if scales_path:
+                self.scales.flush()
+                del self.scales
+        dtype_size = 1 if self.quantize else 4
+        with open(matrix_path, 'ab') as matrix_file:
+            matrix_file.truncate(capacity * self.dimension * dtype_size)
+        if scales_path:
+            with open(scales_path, 'ab') as scales_file:
+                scales_file.truncate(capacity * 4)
+        self.capacity = capacity
+        self._open_matrix(capacity)
+        if self.hnsw is not None:
+            self.hnsw.resize_index(capacity)
+
+    def _open_hnsw(self):
+        index_path = os.path.join(self.path, 'hnsw.bin')
+        self.hnsw = hnswlib.Index(space='ip', dim=self.dimension)
+        if os.path.exists(index_path) and self.ids:
+            self.hnsw.load_index(index_path, max_elements=max(self.capacity, 1))
+        else:
+            self.hnsw.init_index(max_elements=max(self.capacity, 1024), M=self.hnsw_m,
+                                 ef_construction=self.hnsw_ef_construction)
+            live_rows = [row for row, vector_id in enumerate(self.ids) if vector_id is not None]
+            if live_rows:
+                self.hnsw.add_items(self._vectors(live_rows), np.array(live_rows))
+        self.hnsw.set_ef(self.hnsw_ef_search)
+
+    def _index_metadata(self, row):
+        metadata = self.metadata[row]
+        for field in INDEXED_FIELDS:
+            if field in metadata:
+                self.inverted[field].setdefault(metadata[field], set()).add(row)
+
+    def _unindex_metadata(self, row):
+        metadata = self.metadata[row]
+        for field in INDEXED_FIELDS:
+            if field in metadata:
+                self.inverted[field].get(metadata[field], set()).discard(row)
+
+    def _vectors(self, rows):
+        # returns the stored vectors of the given rows as float32
+        if self.quantize:
+            return self.matrix[rows].astype(np.float32) * (self.scales[rows][:, None] / 127.0)
+        return np.asarray(self.matrix[rows], dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def upsert(self, vectors):
+        # vectors is a list of {'id', 'values', 'metadata'} dicts, like a Pinecone upsert
+        if not vectors:
+            return
+        with self.lock:
+            rows = []
+            for vector in vectors:
+                row = self.rows.get(vector['id'])
+                if row is None:
+                    row = len(self.ids)
+                    self.ids.append(vector['id'])
+                    self.metadata.append({})
+                    self.rows[vector['id']] = row
+                else:
+                    self._unindex_metadata(row)
+                self.metadata[row] = vector.get('metadata', {})
+                self._index_metadata(row)
+                rows.append(row)
+            self._grow(len(self.ids))
+
+            normalized = self._normalize([vector['values'] for vector in vectors])
+            rows = np.array(rows)
+            if self.quantize:
+                scales = np.abs(normalized).max(axis=1)
+                scales = np.where(scales == 0, 1, scales)
+                self.matrix[rows] = np.round(normalized / scales[:, None] * 127).astype(np.int8)
+                self.scales[rows] = scales
+            else:
+                self.matrix[rows] = normalized
+            if self.hnsw is not None:
+                self.hnsw.add_items(normalized, rows)
+
+    def delete(self, ids):
+        with self.lock:
+            for vector_id in ids:
+                row = self.rows.pop(vector_id, None)
+                if row is None:
+                    continue
+                self._unindex_metadata(row)
+                self.ids[row] = None
+                self.metadata[row] = {}
+                if self.hnsw is not None:
+                    self.hnsw.mark_deleted(row)
+
+    def _allowed_rows(self, filter):
+        # returns the set of rows matching the filter, None when every row is allowed
+        if not filter:
+            return None
+        candidates = None
+        remaining = {}
+        for field, condition in filter.items():
+            if field in INDEXED_FIELDS and not isinstance(condition, dict):
+                rows = self.inverted[field].get(condition, set())
+                candidates = set(rows) if candidates is None else candidates & rows
+            else:
+                remaining[field] = condition
+        if candidates is None:
+            candidates = set(self.rows.values())
+        if remaining:
+            candidates = {row for row in candidates if matches_filter(self.metadata[row], remaining)}
+        return candidates
+
+    def query(self, vector, top_k=10, filter=None):
+        with self.lock:
+            query = self._normalize(vector)
+            allowed = self._allowed_rows(filter)
+            if not self.rows or (allowed is not None and not allowed):
+                return {'matches': []}
+
+            rows = None
+            if self.hnsw is not None:
+                k = min(top_k, len(self.rows) if allowed is None else len(allowed))
+                try:
+                    rows, distances = self.hnsw.knn_query(
+                        query, k=k, filter=None if allowed is None else allowed.__contains__
+                    )
+                    rows, scores = rows[0], 1 - distances[0]
+                except RuntimeError:
+                    # a restrictive filter can leave the graph search short of k results
+                    rows = None
+            if rows is None:
+                # brute-force search over the live (and allowed) rows
+                candidates = np.array(sorted(self.rows.values() if allowed is None else allowed))
+                scores = self._vectors(candidates) @ query
+                best = np.argsort(-scores)[:top_k]
+                rows, scores = candidates[best], scores[best]
+
+            return {'matches': [
+                {'id': self.ids[row], 'score': float(score), 'metadata': self.metadata[row]}
+                for row, score in zip(rows, scores)
+            ]}
+
+    def save(self):
+        # flushes the vectors and writes the ids, metadata and HNSW index next to them
+        with self.lock:
+            if self.capacity:
+                self.matrix.flush()
+                if self.quantize:
+                    self.scales.flush()
+            if self.hnsw is not None:
+                self.hnsw.save_index(os.path.join(self.path, 'hnsw.bin'))
+            atomic_write_json(self.state_path, {'ids': self.ids, 'metadata': self.metadata, 'capacity': self.capacity})
+
+
+# function to build the vector store selected by the VECTOR_STORE environment variable
+# 'pinecone' (default) uses the serverless Pinecone index, 'local' the on-disk store in LOCAL_VECTOR_STORE_PATH
+def get_vector_store(backend=None):
+    backend = backend or os.getenv('VECTOR_STORE', 'pinecone')
+    if backend == 'pinecone':
+        return PineconeVectorStore(os.getenv('PINECONE_API_KEY'), os.getenv('PINECONE_ENV'))
+    if backend == 'local':
+        return LocalVectorStore(
+            os.getenv('LOCAL_VECTOR_STORE_PATH', 'vector_store'),
+            quantize=os.getenv('LOCAL_VECTOR_STORE_QUANTIZE', '0') == '1',
+        )
+    raise ValueError(f"Unknown vector store: {backend}")